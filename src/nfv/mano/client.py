@@ -0,0 +1,101 @@
+# Copyright (C) 2019 Patrick Ziegler
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+
+import requests
+from ryu.lib import hub
+
+
+class VNFDispatcher:
+
+    def __init__(self, port=8080, timeout=5):
+        self.port = port
+        self.timeout = timeout
+        self.sessions = {}
+
+    def get_session(self, addr):
+        try:
+            return self.sessions[addr]
+        except KeyError:
+            session = requests.Session()
+            session.headers.update({"Content-type": "application/json"})
+            self.sessions[addr] = session
+            return session
+
+    def post(self, addr, cmd, vnf):
+        try:
+            response = self.get_session(addr).post(
+                url="http://%s:%d/vnf/%s" % (addr, self.port, cmd),
+                data=vnf.as_json(),
+                timeout=self.timeout,
+            )
+            return vnf, response.status_code
+        except requests.RequestException as err:
+            print(err)
+            return vnf, None
+
+    def send(self, targets, cmd="add"):
+        threads = [hub.spawn(self.post, addr, cmd, vnf) for addr, vnf in targets]
+        return [thread.wait() for thread in threads]
+
+    def send_async(self, targets, cmd="add", callback=None):
+        def _send():
+            results = self.send(targets, cmd)
+            if callback is not None:
+                callback(results)
+        return hub.spawn(_send)
+
+    def close(self):
+        for session in self.sessions.values():
+            session.close()
+        self.sessions.clear()
+
+
+class AttrReporter:
+
+    def __init__(self, addr="10.0.0.1:8080", period=1, timeout=5):
+        self.addr = addr
+        self.period = period
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({"Content-type": "application/json"})
+        self.samples = {}
+
+    def push(self, attr):
+        key = (attr["src"]["node_id"], attr["dst"]["node_id"])
+        self.samples[key] = attr  # only the latest sample per link is reported
+
+    def flush(self):
+        if not self.samples:
+            return
+        samples, self.samples = self.samples, {}
+        try:
+            self.session.post(
+                url="http://%s/lldp/batch" % self.addr,
+                data=json.dumps(list(samples.values())),
+                timeout=self.timeout,
+            )
+        except requests.RequestException as err:
+            print(err)
+
+    def run(self):
+        while True:
+            hub.sleep(self.period)
+            self.flush()
+
+    def close(self):
+        self.flush()
+        self.session.close()
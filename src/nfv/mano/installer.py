@@ -0,0 +1,88 @@
+# Copyright (C) 2019 Patrick Ziegler
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import time
+from collections import OrderedDict
+
+from ryu.lib import hub
+
+
+class RouteInstaller:
+
+    def __init__(self, timeout=1, bundles=True):
+        self.timeout = timeout
+        self.bundles = bundles
+        self.bundle_id = 0
+        self.waiting = {}
+        self.failed = set()
+
+    def notify(self, msg):
+        try:
+            self.waiting[msg.xid].set()
+        except KeyError:
+            pass
+
+    def notify_error(self, msg):
+        if msg.xid in self.waiting:
+            self.failed.add(msg.xid)
+            self.waiting[msg.xid].set()
+
+    def send_and_wait(self, datapath, msg):
+        datapath.set_xid(msg)
+        event = hub.Event()
+        self.waiting[msg.xid] = event
+        try:
+            datapath.send_msg(msg)
+            return event.wait(timeout=self.timeout) and msg.xid not in self.failed
+        finally:
+            del self.waiting[msg.xid]
+            self.failed.discard(msg.xid)
+
+    def commit_bundle(self, datapath, msgs):
+        ofproto = datapath.ofproto
+        ofproto_parser = datapath.ofproto_parser
+        self.bundle_id = (self.bundle_id + 1) & 0xffffffff
+        flags = ofproto.OFPBF_ATOMIC | ofproto.OFPBF_ORDERED
+        datapath.send_msg(ofproto_parser.OFPBundleCtrlMsg(
+            datapath, self.bundle_id, ofproto.OFPBCT_OPEN_REQUEST, flags, []))
+        for msg in msgs:
+            datapath.send_msg(ofproto_parser.OFPBundleAddMsg(
+                datapath, self.bundle_id, flags, msg, []))
+        return self.send_and_wait(datapath, ofproto_parser.OFPBundleCtrlMsg(
+            datapath, self.bundle_id, ofproto.OFPBCT_COMMIT_REQUEST, flags, []))
+
+    def commit(self, datapath, msgs):
+        if self.bundles and self.commit_bundle(datapath, msgs):
+            return True
+        for msg in msgs:
+            datapath.send_msg(msg)
+        return self.send_and_wait(datapath, datapath.ofproto_parser.OFPBarrierRequest(datapath))
+
+    def install(self, route):
+        # downstream switches are committed first, so that traffic released
+        # upstream never hits a switch which is not yet configured
+        t0 = time.time()
+        success = True
+        for datapath, msgs in reversed(route.items()):
+            if not self.commit(datapath, msgs):
+                success = False
+        return success, time.time() - t0
+
+
+class Route(OrderedDict):
+
+    def add(self, datapath, msg):
+        self.setdefault(datapath, []).append(msg)
+        self.move_to_end(datapath)
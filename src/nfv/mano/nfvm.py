@@ -18,7 +18,6 @@ import socket
 import time
 import uuid
 
-import requests
 from ryu import cfg as RyuCfg
 from ryu.app.wsgi import ControllerBase, Response, WSGIApplication, route
 from ryu.base import app_manager
@@ -29,9 +28,11 @@ from ryu.lib import hub
 from ryu.lib.packet import ether_types, ethernet, lldp, mpls, packet
 from ryu.ofproto import ofproto_v1_4
 
+from nfv.mano.client import AttrReporter
 from nfv.mano.config.nfvm_default_config import get_nfvm_default_config
 from nfv.mano.vim import VIMAgent
 from nfv.monitoring.lldp import LLDPMonitorWorker
+from nfv.monitoring.probes import ProbeContainer, ProbeSampler
 from nfv.placement.sfc import ServiceFunction
 
 ETH_P_ALL = 0x03
@@ -45,19 +46,28 @@ class NFVManager(app_manager.RyuApp):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         if RyuCfg.CONF.iface is None:
-            raise ValueError("Parameter "iface" was None")
+            raise ValueError("Parameter 'iface' was None")
         self.wsgi = kwargs["wsgi"]
         self.wsgi.register(NFVManagerREST, {"nfvm": self})
         self.iface = RyuCfg.CONF.iface
         self.node_id = uuid.uuid4()
         self.datapath = None
         self.monitor = LLDPMonitorWorker()
+        self.reporter = AttrReporter(period=self.monitor.period)
         self.vim = VIMAgent(self.iface)
         self.vim.start()
         self.vnfs = {}
+        self.vnf_probes = {}
+        self.vnf_sampler = ProbeSampler(self.vnf_probes, period=1)
         hub.spawn(self.clean_up_vnfs)
+        hub.spawn(self.reporter.run)
+        hub.spawn(self.monitor.sampler.run, hub.sleep)
+        hub.spawn(self.vnf_sampler.run, hub.sleep)
 
     def stop(self):
+        self.monitor.sampler.close()
+        self.vnf_sampler.close()
+        self.reporter.close()
         self.vim.stop()
         super().stop()
 
@@ -67,20 +77,30 @@ class NFVManager(app_manager.RyuApp):
             for label in list(self.vnfs.keys()):
                 vnf = self.vnfs[label]
                 if vnf.removed and (time.time() - vnf.removed) > vnf.timeout:
+                    self.remove_vnf_probe(vnf)
                     del self.vnfs[label]
 
+    def add_vnf_probe(self, vnf):
+        self.remove_vnf_probe(vnf)
+        try:
+            self.vnf_probes[vnf.label_in] = ProbeContainer(
+                key=vnf.label_in,
+                pid=vnf.container.attrs["State"]["Pid"],
+            )
+        except (OSError, KeyError) as err:
+            print(err)
+
+    def remove_vnf_probe(self, vnf):
+        probe = self.vnf_probes.pop(vnf.label_in, None)
+        if probe is not None:
+            probe.close()
+
     def start_vnf(self, vnf, buffer_id=None):
-        self.vim.start_vnf(vnf)
+        warm = self.vim.start_vnf(vnf)
+        self.add_vnf_probe(vnf)
         self.send_flow_mpls_encap(self.datapath, vnf)
         self.send_flow_mpls_decap(self.datapath, vnf, buffer_id)
-
-    @staticmethod
-    def send_attr(attr):
-        requests.post(
-            url="http://10.0.0.1:8080/lldp",
-            headers={"Content-type": "application/json"},
-            data=json.dumps(attr),
-        )
+        return warm
 
     @staticmethod
     def send_raw(iface, pkt):
@@ -170,38 +190,48 @@ class NFVManager(app_manager.RyuApp):
     def flow_removed_handler(self, ev):
         try:
             vnf = self.vnfs[ev.msg.match["mpls_label"]]
+            self.remove_vnf_probe(vnf)
             self.vim.stop_vnf(vnf)
         except KeyError:
             pass
 
+    def reply_lldp(self, datapath, attr, in_port):
+        self.reporter.push(attr)
+        self.send_packet_out(
+            datapath=datapath,
+            data=self.monitor.pool[datapath]["msg"].data,
+            port=in_port,
+        )
+
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
     def packet_in_handler(self, ev):
         msg_in = ev.msg
         datapath = msg_in.datapath
         in_port = msg_in.match["in_port"]
 
+        attr = self.monitor.parse_raw(datapath, msg_in.match, msg_in.data)
+        if attr is not None:
+            self.reply_lldp(datapath, attr, in_port)
+            return
+
         pkt = packet.Packet(msg_in.data)
         prot_eth = pkt.get_protocols(ethernet.ethernet)[0]
 
         if prot_eth.ethertype == ether_types.ETH_TYPE_LLDP:
             prot_lldp = pkt.get_protocol(lldp.lldp)
             attr = self.monitor.parse(datapath, msg_in.match, prot_eth, prot_lldp)
-            self.send_attr(attr)
-            self.send_packet_out(
-                datapath=datapath,
-                data=self.monitor.pool[datapath]["msg"].data,
-                port=in_port,
-            )
+            self.reply_lldp(datapath, attr, in_port)
 
         elif prot_eth.ethertype == ether_types.ETH_TYPE_MPLS:
             prot_mpls = pkt.get_protocol(mpls.mpls)
             vnf = self.vnfs[prot_mpls.label]
-            self.start_vnf(
+            warm = self.start_vnf(
                 vnf=vnf,
                 buffer_id=msg_in.buffer_id,
             )
             if msg_in.buffer_id == datapath.ofproto.OFP_NO_BUFFER:
-                time.sleep(0.5)
+                if not warm:
+                    time.sleep(0.5)  # give the freshly wired container some time
                 self.send_raw(self.vim.IFACE_DATA, msg_in)
                 #
                 # Sending the packet via OpenFlow as done below does
@@ -223,11 +253,39 @@ class NFVManagerREST(ControllerBase):
 
     @route("status", "/vnf", methods=["GET"])
     def req_handler_vnf(self, req, **kwargs):
+        probes = self.app.vnf_sampler.get()
         return Response(
             content_type="application/json",
-            body=json.dumps([vnf.as_dict() for vnf in self.app.vnfs.values()], indent=4),
+            body=json.dumps([{**vnf.as_dict(), "probes": probes.get(vnf.label_in)}
+                             for vnf in self.app.vnfs.values()], indent=4),
         )
 
+    @route("status", "/vnf/report", methods=["GET", "POST"])
+    def req_handler_vnf_report(self, req, **kwargs):
+        monitor = self.app.monitor
+        if req.method == "GET":
+            return Response(
+                content_type="application/json",
+                body=json.dumps({"enabled": monitor.vnf_sampler is not None}),
+            )
+        else:
+            data = json.loads(req.body)
+            monitor.vnf_sampler = self.app.vnf_sampler if data.get("enabled") else None
+            return Response(status=200)
+
+    @route("vim", "/vnf/pool", methods=["GET", "POST"])
+    def req_handler_vnf_pool(self, req, **kwargs):
+        if req.method == "GET":
+            return Response(
+                content_type="application/json",
+                body=json.dumps(self.app.vim.pool.as_dict(), indent=4),
+            )
+        else:
+            data = json.loads(req.body)
+            data.setdefault("param", None)
+            self.app.vim.pool.set_size(data["image"], data["size"], data["param"])
+            return Response(status=200)
+
     @route("vim", "/vnf/add", methods=["POST"])
     def req_handler_vnf_add(self, req, **kwargs):
         vnf = ServiceFunction.from_json(req.body)
@@ -14,8 +14,8 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import json
+from functools import partial
 
-import requests
 from ryu.app.wsgi import ControllerBase, Response, WSGIApplication, route
 from ryu.base import app_manager
 from ryu.controller import ofp_event
@@ -25,9 +25,15 @@ from ryu.lib import hub
 from ryu.lib.packet import ether_types, ethernet, ipv4, lldp, mpls, packet
 from ryu.ofproto import ofproto_v1_4
 
+from nfv.mano.client import VNFDispatcher
 from nfv.mano.config.nfvo_default_config import get_nfvo_default_config
+from nfv.mano.installer import Route, RouteInstaller
 from nfv.mano.mixin.learning_switch import L2SwitchMixin
+from nfv.monitoring.filters import RunningStats
 from nfv.monitoring.lldp import LLDPMonitor
+from nfv.monitoring.scheduler import ProbeScheduler
+from nfv.placement.cache import PlacementCache
+from nfv.placement.executor import PlacementExecutor
 from nfv.placement.sfc import ServiceFunctionChain, ServiceHook
 from nfv.placement.topo import NetworkModel
 
@@ -43,36 +49,134 @@ class NFVOrchestrator(app_manager.RyuApp, L2SwitchMixin):
         self.wsgi = kwargs["wsgi"]
         self.wsgi.register(NFVOrchestratorREST, {"nfvo": self})
         self.monitor = LLDPMonitor()
+        self.scheduler = ProbeScheduler()
+        self.adaptive = False
+        self.lldp_stats = {}
         self.model = NetworkModel()
+        self.model.subscribe(self.model_changed)
+        self.dispatcher = VNFDispatcher()
+        self.installer = RouteInstaller()
+        self.placement_cache = PlacementCache()
+        self.executor = None
         self.services = {}
+        self.hooks = {}
+        self.pending = set()
         self.datapaths = {}
         self.ip_to_dp = {}
         hub.spawn(self.lldp_loop)
 
     def stop(self):
         print(self.model.as_json(indent=4))
+        self.dispatcher.close()
+        self.set_executor(0)
         super().stop()
 
+    def set_executor(self, workers):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        if workers > 0:
+            self.executor = PlacementExecutor(max_workers=workers, sleep=hub.sleep)
+
+    def model_changed(self, model, changes, structural):
+        if structural:
+            self.logger.info("Topology changed in epoch %d (%d edges updated)",
+                             model.epoch, len(changes))
+
     def lldp_loop(self):
         while True:
-            hub.sleep(self.monitor.period)
-            self.monitor.flood()
+            if not self.adaptive:
+                if self.monitor.paced:
+                    self.monitor.flood_paced(hub.sleep)
+                else:
+                    hub.sleep(self.monitor.period)
+                    self.monitor.flood()
+                continue
+            for node_id in self.scheduler.due():
+                try:
+                    self.monitor.send(self.datapaths[node_id])
+                except KeyError:
+                    self.scheduler.remove(node_id)
+            hub.sleep(self.scheduler.sleep_time())
+
+    def update_model(self, attrs):
+        edges = [(attr["src"]["node_id"], attr["dst"]["node_id"]) for attr in attrs]
+        for edge, attr in zip(edges, attrs):
+            try:
+                self.lldp_stats[edge].update(attr["link"]["rtt_queue"])
+            except KeyError:
+                self.lldp_stats[edge] = RunningStats()
+                self.lldp_stats[edge].update(attr["link"]["rtt_queue"])
+        self.model.update_batch(attrs)
+        for node_id_src, node_id_dst in edges:
+            self.scheduler.observe(node_id_src, node_id_dst,
+                                   self.model.model[node_id_src][node_id_dst]["latency_raw"])
 
     def find_service(self, hook):
-        for sfc in self.services.values():
-            if sfc.hook == hook:
-                return sfc
-
-    def send_vnf_requests(self, sfc, cmd="add"):
-        for vnf in sfc.get_vnfs():
-            addr = self.model.get_addr(vnf.node_id)
-            requests.post(
-                url="http://%s:8080/vnf/%s" % (addr, cmd),
-                headers={"Content-type": "application/json"},
-                data=vnf.as_json(),
-            )
+        return self.hooks.get(hook.key)
+
+    def register_service(self, sfc):
+        self.services[sfc.label] = sfc
+        self.hooks[sfc.hook.key] = sfc
+
+    def is_registered(self, sfc):
+        return self.services.get(sfc.label) is sfc
+
+    def unregister_service(self, sfc):
+        del self.services[sfc.label]
+        del self.hooks[sfc.hook.key]
+        self.model.free(sfc.get_nodes())
+
+    def send_vnf_requests(self, sfc, cmd="add", callback=None):
+        targets = [(self.model.get_addr(vnf.node_id), vnf)
+                   for vnf in sfc.get_vnfs() if vnf.node_id is not None]
+        return self.dispatcher.send_async(targets, cmd, callback)
+
+    def embed_service(self, sfc, msg_in=None):
+        if sfc.label in self.pending:
+            return  # embedding of this service is already in flight
+        self.pending.add(sfc.label)
+        try:
+            sfc.place(self.model, self.placement_cache, self.executor)
+            if not self.is_registered(sfc):
+                self.pending.discard(sfc.label)
+                return  # removed while the placement was calculated
+            sfc.assign(self.model)
+            self.scheduler.boost({node for path in sfc.placement.paths for node in path})
+            self.send_vnf_requests(sfc, "add", callback=partial(self.complete_service, sfc, msg_in))
+        except Exception:
+            self.pending.discard(sfc.label)
+            raise
+
+    def complete_service(self, sfc, msg_in, results):
+        for result in results:
+            if result is None or result[1] != 200:
+                self.logger.warning("VNF request for service %d failed: %s", sfc.label, result)
+        try:
+            if not self.is_registered(sfc):
+                return  # removed while the vnfs were started
+            route, buffer_port = self.implant_service_route(sfc)
+            success, sfc.install_latency = self.installer.install(route)
+            self.logger.info("Installed route of service %d in %.3f ms",
+                             sfc.label, 1e3 * sfc.install_latency)
+            if not success:
+                self.logger.warning("Route of service %d was not confirmed by all switches",
+                                    sfc.label)
+            if msg_in is not None and buffer_port is not None:
+                datapath = msg_in.datapath
+                buffered = msg_in.buffer_id != datapath.ofproto.OFP_NO_BUFFER
+                self.send_packet_out(
+                    datapath=datapath,
+                    buffer_id=msg_in.buffer_id,
+                    in_port=msg_in.match["in_port"],
+                    data=None if buffered else msg_in.data,
+                    port=buffer_port,
+                )
+        finally:
+            self.pending.discard(sfc.label)
 
-    def implant_service_route(self, sfc, buffer_id):
+    def implant_service_route(self, sfc):
+        route = Route()
         buffer_port = None
         for label, path in sfc.get_paths():
             for i in range(len(path) - 1):
@@ -85,12 +189,10 @@ class NFVOrchestrator(app_manager.RyuApp, L2SwitchMixin):
                 ofproto_parser = datapath.ofproto_parser
                 if buffer_port is None:
                     buffer_port = port
-                else:
-                    buffer_id = ofproto.OFP_NO_BUFFER
-                datapath.send_msg(
+                route.add(
+                    datapath,
                     ofproto_parser.OFPFlowMod(
                         datapath=datapath,
-                        buffer_id=buffer_id,
                         table_id=2,
                         priority=1,
                         match=ofproto_parser.OFPMatch(
@@ -112,7 +214,8 @@ class NFVOrchestrator(app_manager.RyuApp, L2SwitchMixin):
                 datapath = self.datapaths[path[-1]]
                 ofproto = datapath.ofproto
                 ofproto_parser = datapath.ofproto_parser
-                datapath.send_msg(
+                route.add(
+                    datapath,
                     ofproto_parser.OFPFlowMod(
                         datapath=datapath,
                         table_id=2,
@@ -133,58 +236,108 @@ class NFVOrchestrator(app_manager.RyuApp, L2SwitchMixin):
                         idle_timeout=sfc.timeout
                     )
                 )
-        return buffer_port
+        return route, buffer_port
 
     @classmethod
-    def add_service_hook(cls, sfc):
+    def get_service_hook_msg(cls, sfc, command=None):
         datapath = sfc.hook.src_dp
         ofproto = datapath.ofproto
         ofproto_parser = datapath.ofproto_parser
-        datapath.send_msg(
-            ofproto_parser.OFPFlowMod(
-                datapath=datapath,
-                table_id=1,
-                priority=1,
-                match=ofproto_parser.OFPMatch(
-                    eth_type=ether_types.ETH_TYPE_IP,
-                    ipv4_src=sfc.hook.src_ip,
-                    ipv4_dst=sfc.hook.dst_ip,
-                ),
-                instructions=[
-                    ofproto_parser.OFPInstructionActions(
-                        type_=ofproto.OFPIT_APPLY_ACTIONS,
-                        actions=[
-                            ofproto_parser.OFPActionPushMpls(),
-                            ofproto_parser.OFPActionSetField(mpls_label=sfc.label),
-                        ],
-                    ),
-                    ofproto_parser.OFPInstructionGotoTable(table_id=2),
-                ],
-            )
+        match = ofproto_parser.OFPMatch(
+            eth_type=ether_types.ETH_TYPE_IP,
+            ipv4_src=sfc.hook.src_ip,
+            ipv4_dst=sfc.hook.dst_ip,
         )
-
-    @classmethod
-    def remove_service_hook(cls, sfc):
-        datapath = sfc.hook.src_dp
-        ofproto = datapath.ofproto
-        ofproto_parser = datapath.ofproto_parser
-        datapath.send_msg(
-            ofproto_parser.OFPFlowMod(
+        if command == ofproto.OFPFC_DELETE:
+            return ofproto_parser.OFPFlowMod(
                 command=ofproto.OFPFC_DELETE,
                 datapath=datapath,
                 table_id=1,
                 priority=1,
-                match=ofproto_parser.OFPMatch(
-                    eth_type=ether_types.ETH_TYPE_IP,
-                    ipv4_src=sfc.hook.src_ip,
-                    ipv4_dst=sfc.hook.dst_ip,
-                ),
+                match=match,
                 buffer_id=ofproto.OFPCML_NO_BUFFER,
                 out_port=ofproto.OFPP_ANY,
                 out_group=ofproto.OFPG_ANY,
             )
+        return ofproto_parser.OFPFlowMod(
+            datapath=datapath,
+            table_id=1,
+            priority=1,
+            match=match,
+            instructions=[
+                ofproto_parser.OFPInstructionActions(
+                    type_=ofproto.OFPIT_APPLY_ACTIONS,
+                    actions=[
+                        ofproto_parser.OFPActionPushMpls(),
+                        ofproto_parser.OFPActionSetField(mpls_label=sfc.label),
+                    ],
+                ),
+                ofproto_parser.OFPInstructionGotoTable(table_id=2),
+            ],
         )
 
+    @classmethod
+    def add_service_hook(cls, sfc):
+        sfc.hook.src_dp.send_msg(cls.get_service_hook_msg(sfc))
+
+    @classmethod
+    def remove_service_hook(cls, sfc):
+        datapath = sfc.hook.src_dp
+        datapath.send_msg(cls.get_service_hook_msg(sfc, datapath.ofproto.OFPFC_DELETE))
+
+    @staticmethod
+    def send_burst(msgs):
+        for datapath in msgs:
+            for msg in msgs[datapath]:
+                datapath.send_msg(msg)
+            datapath.send_msg(datapath.ofproto_parser.OFPBarrierRequest(datapath))
+
+    def add_services(self, nsds):
+        status = []
+        msgs = {}
+        proactive = []
+        for nsd in nsds:
+            try:
+                sfc = ServiceFunctionChain.from_dict(nsd, self.ip_to_dp)
+            except (AttributeError, KeyError, TypeError, ValueError) as err:
+                status.append({"status": 400, "error": repr(err)})
+                continue
+            if self.find_service(sfc.hook):
+                sfc.release()
+                status.append({"status": 409})
+                continue
+            self.register_service(sfc)
+            msgs.setdefault(sfc.hook.src_dp, []).append(self.get_service_hook_msg(sfc))
+            if sfc.proactive:
+                proactive.append(sfc)
+            status.append({"status": 200, "label": sfc.label})
+        self.send_burst(msgs)
+        for sfc in proactive:
+            hub.spawn(self.embed_service, sfc)
+        return status
+
+    def remove_services(self, nsds):
+        status = []
+        msgs = {}
+        for nsd in nsds:
+            try:
+                sfc = self.find_service(ServiceHook.from_dict(nsd))
+            except (KeyError, TypeError) as err:
+                status.append({"status": 400, "error": repr(err)})
+                continue
+            if sfc:
+                self.unregister_service(sfc)
+                datapath = sfc.hook.src_dp
+                msgs.setdefault(datapath, []).append(
+                    self.get_service_hook_msg(sfc, datapath.ofproto.OFPFC_DELETE))
+                self.send_vnf_requests(sfc, "remove")
+                sfc.release()
+                status.append({"status": 200, "label": sfc.label})
+            else:
+                status.append({"status": 404})
+        self.send_burst(msgs)
+        return status
+
     @staticmethod
     def send_packet_out(datapath, port, **kwargs):
         ofproto = datapath.ofproto
@@ -205,12 +358,29 @@ class NFVOrchestrator(app_manager.RyuApp, L2SwitchMixin):
             datapath.send_msg(msg)
         self.datapaths[datapath.id] = datapath
         self.monitor.add(datapath)
+        self.scheduler.add(datapath.id)
+
+    @set_ev_cls(ofp_event.EventOFPBarrierReply, MAIN_DISPATCHER)
+    def barrier_reply_handler(self, ev):
+        self.installer.notify(ev.msg)
+
+    @set_ev_cls(ofp_event.EventOFPBundleCtrlMsg, MAIN_DISPATCHER)
+    def bundle_ctrl_handler(self, ev):
+        self.installer.notify(ev.msg)
+
+    @set_ev_cls(ofp_event.EventOFPErrorMsg, MAIN_DISPATCHER)
+    def error_msg_handler(self, ev):
+        self.installer.notify_error(ev.msg)
 
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
     def packet_in_handler(self, ev):
         msg_in = ev.msg
         datapath = msg_in.datapath
-        in_port = msg_in.match["in_port"]
+
+        attr = self.monitor.parse_raw(datapath, msg_in.match, msg_in.data)
+        if attr is not None:
+            self.update_model([attr])
+            return
 
         pkt = packet.Packet(msg_in.data)
         prot_eth = pkt.get_protocol(ethernet.ethernet)
@@ -218,7 +388,7 @@ class NFVOrchestrator(app_manager.RyuApp, L2SwitchMixin):
         if prot_eth.ethertype == ether_types.ETH_TYPE_LLDP:
             prot_lldp = pkt.get_protocol(lldp.lldp)
             attr = self.monitor.parse(datapath, msg_in.match, prot_eth, prot_lldp)
-            self.model.update(attr)
+            self.update_model([attr])
 
         elif prot_eth.ethertype == ether_types.ETH_TYPE_IP and msg_in.table_id == 0:
             ofproto_parser = datapath.ofproto_parser
@@ -240,21 +410,7 @@ class NFVOrchestrator(app_manager.RyuApp, L2SwitchMixin):
 
         elif prot_eth.ethertype == ether_types.ETH_TYPE_MPLS:
             prot_mpls = pkt.get_protocol(mpls.mpls)
-            sfc = self.services[prot_mpls.label]
-            sfc.embedding(self.model.model)
-            self.send_vnf_requests(sfc, "add")
-            buffer_port = self.implant_service_route(
-                sfc=sfc,
-                buffer_id=msg_in.buffer_id
-            )
-            if msg_in.buffer_id == datapath.ofproto.OFP_NO_BUFFER:
-                self.send_packet_out(
-                    datapath=datapath,
-                    buffer_id=msg_in.buffer_id,
-                    in_port=in_port,
-                    data=msg_in.data,
-                    port=buffer_port,
-                )
+            hub.spawn(self.embed_service, self.services[prot_mpls.label], msg_in)
 
         else:
             self.learn_mac(datapath, msg_in, prot_eth)
@@ -271,7 +427,15 @@ class NFVOrchestratorREST(ControllerBase):
     def req_handler_lldp(self, req, **kwargs):
         attr = json.loads(req.body)
         attr["dst"]["addr"] = req.remote_addr
-        self.app.model.update(attr)
+        self.app.update_model([attr])
+        return Response(status=200)
+
+    @route("monitoring", "/lldp/batch", methods=["POST"])
+    def req_handler_lldp_batch(self, req, **kwargs):
+        attrs = json.loads(req.body)
+        for attr in attrs:
+            attr["dst"]["addr"] = req.remote_addr
+        self.app.update_model(attrs)
         return Response(status=200)
 
     @route("monitoring", "/lldp/period", methods=["GET", "POST"])
@@ -286,6 +450,43 @@ class NFVOrchestratorREST(ControllerBase):
             self.app.monitor.period = data["period"]
             return Response(status=200)
 
+    @route("monitoring", "/lldp/stats", methods=["GET", "POST"])
+    def req_handler_lldp_stats(self, req, **kwargs):
+        if req.method == "GET":
+            stats = self.app.lldp_stats
+            std = [e.var ** 0.5 for e in stats.values() if e.count > 1]
+            return Response(
+                content_type="application/json",
+                body=json.dumps({
+                    "mode": "adaptive" if self.app.adaptive else
+                            "paced" if self.app.monitor.paced else "flood",
+                    "std_mean": sum(std) / len(std) if std else None,
+                    "edges": [{"src": a, "dst": b, "rtt_queue": e.as_dict()}
+                              for (a, b), e in stats.items()],
+                }, indent=2),
+            )
+        else:
+            self.app.lldp_stats.clear()
+            return Response(status=200)
+
+    @route("monitoring", "/lldp/scheduler", methods=["GET", "POST"])
+    def req_handler_lldp_scheduler(self, req, **kwargs):
+        scheduler = self.app.scheduler
+        if req.method == "GET":
+            return Response(
+                content_type="application/json",
+                body=json.dumps({"adaptive": self.app.adaptive, **scheduler.as_dict()}, indent=2),
+            )
+        else:
+            data = json.loads(req.body)
+            self.app.adaptive = data.get("adaptive", self.app.adaptive)
+            self.app.monitor.paced = data.get("paced", self.app.monitor.paced)
+            self.app.monitor.jitter = data.get("jitter", self.app.monitor.jitter)
+            scheduler.period_min = data.get("period_min", scheduler.period_min)
+            scheduler.period_max = data.get("period_max", scheduler.period_max)
+            scheduler.budget = data.get("budget", scheduler.budget)
+            return Response(status=200)
+
     @route("status", "/model", methods=["GET"])
     def req_handler_model(self, req, **kwargs):
         return Response(
@@ -293,6 +494,36 @@ class NFVOrchestratorREST(ControllerBase):
             body=self.app.model.as_json(indent=2),
         )
 
+    @route("status", "/model/history", methods=["GET"])
+    def req_handler_model_history(self, req, **kwargs):
+        try:
+            start = float(req.GET["start"]) if "start" in req.GET else None
+            end = float(req.GET["end"]) if "end" in req.GET else None
+            history = self.app.model.history.query(start, end, req.GET.get("agg", "mean"))
+        except (KeyError, ValueError):
+            return Response(status=400)
+        return Response(
+            content_type="application/json",
+            body=json.dumps(history, indent=2),
+        )
+
+    @route("status", "/model/estimator", methods=["POST"])
+    def req_handler_model_estimator(self, req, **kwargs):
+        data = json.loads(req.body)
+        try:
+            self.app.model.set_estimator(data.pop("name"), **data)
+        except (KeyError, TypeError, ValueError):
+            return Response(status=400)
+        return Response(status=200)
+
+    @route("status", "/model/threshold", methods=["POST"])
+    def req_handler_model_threshold(self, req, **kwargs):
+        data = json.loads(req.body)
+        model = self.app.model
+        model.threshold_rel = data.get("rel", model.threshold_rel)
+        model.threshold_abs = data.get("abs", model.threshold_abs)
+        return Response(status=200)
+
     @route("status", "/sfc", methods=["GET"])
     def req_handler_sfc(self, req, **kwargs):
         return Response(
@@ -300,6 +531,35 @@ class NFVOrchestratorREST(ControllerBase):
             body=json.dumps([sfc.as_dict() for sfc in self.app.services.values()], indent=2),
         )
 
+    @route("status", "/placement/cache", methods=["GET", "POST"])
+    def req_handler_placement_cache(self, req, **kwargs):
+        cache = self.app.placement_cache
+        if req.method == "GET":
+            return Response(
+                content_type="application/json",
+                body=json.dumps(cache.as_dict(), indent=2),
+            )
+        else:
+            data = json.loads(req.body)
+            cache.maxsize = data.get("maxsize", cache.maxsize)
+            cache.ttl = data.get("ttl", cache.ttl)
+            if data.get("clear", False):
+                cache.clear()
+            return Response(status=200)
+
+    @route("status", "/placement/executor", methods=["GET", "POST"])
+    def req_handler_placement_executor(self, req, **kwargs):
+        if req.method == "GET":
+            executor = self.app.executor
+            return Response(
+                content_type="application/json",
+                body=json.dumps({"workers": 0 if executor is None else executor.max_workers}),
+            )
+        else:
+            data = json.loads(req.body)
+            self.app.set_executor(int(data.get("workers", 0)))
+            return Response(status=200)
+
     @route("status", "/plot", methods=["GET"])
     def req_handler_plot(self, req, **kwargs):
         self.app.model.plot()
@@ -309,9 +569,12 @@ class NFVOrchestratorREST(ControllerBase):
     def req_handler_sfc_add(self, req, **kwargs):
         sfc = ServiceFunctionChain.from_json(req.body, self.app.ip_to_dp)
         if self.app.find_service(sfc.hook):
+            sfc.release()
             return Response(status=409)
         self.app.add_service_hook(sfc)
-        self.app.services[sfc.label] = sfc
+        self.app.register_service(sfc)
+        if sfc.proactive:
+            hub.spawn(self.app.embed_service, sfc)
         return Response(status=200)
 
     @route("mano", "/sfc/remove", methods=["POST"])
@@ -320,6 +583,21 @@ class NFVOrchestratorREST(ControllerBase):
         sfc = self.app.find_service(hook)
         if sfc:
             self.app.remove_service_hook(sfc)
-            del self.app.services[sfc.label]
+            self.app.unregister_service(sfc)
             self.app.send_vnf_requests(sfc, "remove")
+            sfc.release()
         return Response(status=200)
+
+    @route("mano", "/sfc/add/batch", methods=["POST"])
+    def req_handler_sfc_add_batch(self, req, **kwargs):
+        return Response(
+            content_type="application/json",
+            body=json.dumps(self.app.add_services(json.loads(req.body)), indent=2),
+        )
+
+    @route("mano", "/sfc/remove/batch", methods=["POST"])
+    def req_handler_sfc_remove_batch(self, req, **kwargs):
+        return Response(
+            content_type="application/json",
+            body=json.dumps(self.app.remove_services(json.loads(req.body)), indent=2),
+        )
@@ -18,12 +18,18 @@ import random
 import resource
 import tempfile
 import time
+from collections import namedtuple
 
 import docker
 import netifaces
+from ryu.lib import hub
 
+from nfv.util.netlink import NetlinkRoute
+from nfv.util.ovsdb import OVSDBClient
 from nfv.util.shell import shell_exec
 
+WarmContainer = namedtuple("WarmContainer", ("container", "iface", "port"))
+
 
 def set_memlock(size=8):
     limit = size * 1024 * 1024  # 8 MiB (necessary for extensive xpd deployment)
@@ -39,6 +45,74 @@ def get_iface():
     return iface
 
 
+class ContainerPool:
+
+    def __init__(self, vim, sizes=None):
+        self.vim = vim
+        self.sizes = {}
+        self.idle = {}
+        self.filling = set()
+        if sizes is not None:
+            for (image, param), size in sizes.items():
+                self.sizes[(image, param)] = size
+
+    def set_size(self, image, size, param=None):
+        key = (image, param)
+        if size > 0:
+            self.sizes[key] = size
+        else:
+            self.sizes.pop(key, None)
+        self.trim(key)
+        self.fill(key)
+
+    def acquire(self, image, param=None):
+        key = (image, param)
+        try:
+            return self.idle[key].pop()
+        except (KeyError, IndexError):
+            return None
+        finally:
+            self.fill(key)
+
+    def fill(self, key):
+        if key in self.filling or len(self.idle.get(key, [])) >= self.sizes.get(key, 0):
+            return
+        self.filling.add(key)
+        hub.spawn(self._fill, key)
+
+    def _fill(self, key):
+        try:
+            idle = self.idle.setdefault(key, [])
+            while len(idle) < self.sizes.get(key, 0):
+                idle.append(self.vim.create_container(*key))
+        except (docker.errors.DockerException, OSError, SystemError) as err:
+            print(err)
+        finally:
+            self.filling.discard(key)
+
+    def fill_all(self):
+        for key in self.sizes:
+            self.fill(key)
+
+    def trim(self, key):
+        idle = self.idle.get(key, [])
+        while len(idle) > self.sizes.get(key, 0):
+            self.vim.destroy_container(idle.pop())
+
+    def clear(self):
+        self.sizes.clear()
+        for key in list(self.idle):
+            self.trim(key)
+
+    def as_dict(self):
+        return [{
+            "image": image,
+            "param": param,
+            "size": size,
+            "idle": len(self.idle.get((image, param), [])),
+        } for (image, param), size in self.sizes.items()]
+
+
 class VIMAgent:
 
     BPF_DIR = os.path.abspath(os.sep.join(
@@ -52,30 +126,45 @@ class VIMAgent:
 
     DCLI = docker.from_env()
 
-    def __init__(self, iface):
+    def __init__(self, iface, pool=None):
         self.iface = iface
         self.netns = "ovs-%s" % iface
         self.tmpdir = tempfile.TemporaryDirectory(prefix="ovs-")
         self.ovs_sock = "--db=unix:%s/db.sock" % self.tmpdir.name
         self.ovs_bridge_name = "br0"
+        self.ovsdb = OVSDBClient("%s/db.sock" % self.tmpdir.name)
+        self.netlinks = {}
+        self.pool = ContainerPool(self, pool)
 
     def exec(self, cmd, **kwargs):
         kwargs.setdefault("verbose", True)
         return shell_exec(cmd, **kwargs)
 
+    def netlink(self, netns=None):
+        try:
+            return self.netlinks[netns]
+        except KeyError:
+            self.netlinks[netns] = NetlinkRoute(netns)
+            return self.netlinks[netns]
+
+    def close_netlink(self, netns):
+        try:
+            self.netlinks.pop(netns).close()
+        except KeyError:
+            pass
+
     def create_link(self, iface_in, iface_out, addr_in=None, addr_out=None, netns_out=None):
-        self.exec("ip link add name %s type veth peer name %s netns %s" %
-                  (iface_out, iface_in, self.netns), netns=netns_out)
-        self.exec("ip link set dev %s up" %
-                  (iface_in,), netns=self.netns)
-        self.exec("ip link set dev %s up" %
-                  (iface_out,), netns=netns_out)
+        nl_in = self.netlink(self.netns)
+        nl_out = self.netlink(netns_out)
+        nl_out.link_add_veth(iface_out, iface_in, peer_netns=self.netns)
+        nl_in.link_set_up(iface_in)
+        nl_out.link_set_up(iface_out)
         if addr_in is not None:
-            self.exec("ip a add %s dev %s" %
-                      (addr_in, iface_in), netns=self.netns)
+            nl_in.addr_add(iface_in, addr_in)
         if addr_out is not None:
-            self.exec("ip a add %s dev %s" %
-                      (addr_out, iface_out), netns=netns_out)
+            nl_out.addr_add(iface_out, addr_out)
+        if isinstance(netns_out, int):
+            self.close_netlink(netns_out)  # container namespaces are short-lived
 
     def create_ovsdb(self):
         self.exec("ovsdb-tool create %s/conf.db"
@@ -148,7 +237,10 @@ class VIMAgent:
         self.exec("ovs-vsctl %s set-controller %s %s tcp:10.2.0.1:6653" %
                   (self.ovs_sock, self.ovs_bridge_name, self.IFACE_CTRL_NETNS), netns=self.netns)
 
+        self.pool.fill_all()
+
     def stop(self):
+        self.pool.clear()
         self.exec("ovs-vsctl %s del-br %s" %
                   (self.ovs_sock, self.ovs_bridge_name), netns=self.netns)
         with open("%s/ovs-vswitchd.pid" % self.tmpdir.name) as fp:
@@ -157,22 +249,24 @@ class VIMAgent:
             shell_exec("kill %d" % int(fp.read()))
         self.exec("ip link delete %s" % self.IFACE_DATA_NETNS, netns=self.netns)
         self.exec("ip link delete %s" % self.IFACE_CTRL_NETNS, netns=self.netns)
+        self.ovsdb.close()
+        for netns in list(self.netlinks):
+            self.close_netlink(netns)
         self.exec("ip netns delete %s" % self.netns)
         self.exec("ip link set %s xdp off" % self.iface)
         self.exec("tc qdisc del dev %s clsact" % self.IFACE_DATA_NETNS, netns=self.netns)
         # self.exec("ip netns delete %s" % self.netns)
 
     def ovs_add_port(self, iface):
-        self.exec("ovs-vsctl %s add-port %s %s" % (self.ovs_sock, self.BRIDGE_NAME, iface))
+        self.ovsdb.add_port(self.BRIDGE_NAME, iface)
 
     def ovs_get_port(self, iface):
-        res, _, _ = self.exec("ovs-vsctl %s get Interface %s ofport" % (self.ovs_sock, iface))
-        return int(res)
+        return self.ovsdb.get_port(iface)
 
     def ovs_del_port(self, iface):
-        self.exec("ovs-vsctl %s del-port %s %s" % (self.ovs_sock, self.BRIDGE_NAME, iface))
+        self.ovsdb.del_port(self.BRIDGE_NAME, iface)
 
-    def start_vnf(self, vnf, **kwargs):
+    def create_container(self, image, param=None, **kwargs):
         kwargs.update({
             "tty": True,
             "stdin_open": True,
@@ -180,19 +274,32 @@ class VIMAgent:
             "network_mode": "none",
             "remove": True,
         })
-        vnf.container = self.DCLI.containers.run(vnf.image, command=vnf.param, **kwargs)
-        while not vnf.container.attrs["State"]["Running"]:
-            vnf.container.reload()
+        container = self.DCLI.containers.run(image, command=param, **kwargs)
+        while not container.attrs["State"]["Running"]:
+            container.reload()
             time.sleep(0.1)
-        vnf.iface = get_iface()
+        iface = get_iface()
         self.create_link(
-            iface_in=vnf.iface,
+            iface_in=iface,
             iface_out="eth0",
-            netns_out=vnf.container.attrs["State"]["Pid"],
+            netns_out=container.attrs["State"]["Pid"],
         )
-        self.ovs_add_port(vnf.iface)
-        vnf.port = self.ovs_get_port(vnf.iface)
+        self.ovs_add_port(iface)
+        return WarmContainer(container, iface, self.ovs_get_port(iface))
+
+    def destroy_container(self, warm):
+        self.ovs_del_port(warm.iface)
+        warm.container.kill()
+
+    def start_vnf(self, vnf, **kwargs):
+        warm = self.pool.acquire(vnf.image, vnf.param)
+        if warm is None:
+            vnf.container, vnf.iface, vnf.port = self.create_container(
+                vnf.image, vnf.param, **kwargs)
+        else:
+            vnf.container, vnf.iface, vnf.port = warm
         vnf.stopped = None
+        return warm is not None
 
     def stop_vnf(self, vnf):
         self.ovs_del_port(vnf.iface)
@@ -0,0 +1,135 @@
+# Copyright (C) 2019 Patrick Ziegler
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from functools import partial
+
+
+class RawEstimator:
+
+    def __init__(self):
+        self.value = None
+
+    def update(self, value, rtt=None):
+        self.value = value
+        return self.value
+
+
+class EWMAEstimator:
+
+    def __init__(self, alpha=0.125):
+        if not 0 < alpha <= 1:
+            raise ValueError("EWMA weight must be in (0, 1]")
+        self.alpha = alpha
+        self.value = None
+
+    def update(self, value, rtt=None):
+        if self.value is None:
+            self.value = value
+        else:
+            self.value += self.alpha * (value - self.value)
+        return self.value
+
+
+class WindowEstimator:
+
+    def __init__(self, size=8):
+        if size < 1:
+            raise ValueError("Window size must be positive")
+        self.samples = [None] * size
+        self.cursor = 0
+        self.count = 0
+        self.value = None
+
+    def push(self, sample):
+        self.samples[self.cursor] = sample
+        self.cursor = (self.cursor + 1) % len(self.samples)
+        self.count = min(self.count + 1, len(self.samples))
+
+    def window(self):
+        return self.samples[:self.count]
+
+    def update(self, value, rtt=None):
+        self.push(value)
+        self.value = self.estimate()
+        return self.value
+
+    def estimate(self):
+        raise NotImplementedError
+
+
+class MinEstimator(WindowEstimator):
+
+    def estimate(self):
+        return min(self.window())
+
+
+class MedianEstimator(WindowEstimator):
+
+    def estimate(self):
+        window = sorted(self.window())
+        mid = len(window) // 2
+        if len(window) % 2:
+            return window[mid]
+        return (window[mid - 1] + window[mid]) / 2
+
+
+class ClockFilterEstimator(WindowEstimator):
+
+    # like the NTP clock filter, the sample with the shortest round trip on
+    # the control channel is the one least affected by asymmetric delays
+
+    def update(self, value, rtt=None):
+        self.push((float("inf") if rtt is None else rtt, value))
+        self.value = self.estimate()
+        return self.value
+
+    def estimate(self):
+        return min(self.window())[1]
+
+
+class RunningStats:
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    @property
+    def var(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def as_dict(self):
+        return {"count": self.count, "mean": self.mean, "std": self.var ** 0.5}
+
+
+ESTIMATOR_CLASSES = {
+    "raw": RawEstimator,
+    "ewma": EWMAEstimator,
+    "min": MinEstimator,
+    "median": MedianEstimator,
+    "clock": ClockFilterEstimator,
+}
+
+
+def get_estimator_factory(name, **kwargs):
+    factory = partial(ESTIMATOR_CLASSES[name], **kwargs)
+    factory()  # partial does not check the arguments, fail here instead of on update
+    return factory
@@ -0,0 +1,190 @@
+# Copyright (C) 2019 Patrick Ziegler
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import time
+import warnings
+
+import numpy as np
+
+AGGREGATIONS = {
+    "mean": np.nanmean,
+    "min": np.nanmin,
+    "max": np.nanmax,
+    "p50": lambda values, axis: np.nanpercentile(values, 50, axis=axis),
+    "p99": lambda values, axis: np.nanpercentile(values, 99, axis=axis),
+}
+
+# (seconds per sample, number of samples), 0 keeps every sample as is. Each
+# sample costs 8 bytes for the timestamp plus 4 bytes per field, so a full
+# edge series (5 fields) takes 270 * 28 B = ~7.5 kB and a node series (4
+# fields) ~6.5 kB. Buffers grow on demand, idle tiers stay small.
+DEFAULT_TIERS = ((0, 60), (10, 90), (60, 120))
+
+
+class RingBuffer:
+
+    def __init__(self, capacity, width, size=8):
+        self.capacity = capacity
+        size = min(size, capacity)
+        self.timestamps = np.full(size, np.nan)
+        self.values = np.full((size, width), np.nan, dtype=np.float32)
+        self.cursor = 0
+        self.count = 0
+
+    def grow(self):
+        # only called while the buffer has not wrapped yet, rows are in order
+        size = min(2 * len(self.timestamps), self.capacity)
+        timestamps = np.full(size, np.nan)
+        values = np.full((size, self.values.shape[1]), np.nan, dtype=np.float32)
+        timestamps[:self.count] = self.timestamps[:self.count]
+        values[:self.count] = self.values[:self.count]
+        self.timestamps = timestamps
+        self.values = values
+        self.cursor = self.count
+
+    def append(self, timestamp, values):
+        if self.count == len(self.timestamps) < self.capacity:
+            self.grow()
+        self.timestamps[self.cursor] = timestamp
+        self.values[self.cursor] = values
+        self.cursor = (self.cursor + 1) % len(self.timestamps)
+        self.count = min(self.count + 1, len(self.timestamps))
+
+    def oldest(self):
+        if self.count == 0:
+            return None
+        return self.timestamps[(self.cursor - self.count) % len(self.timestamps)]
+
+    def select(self, start, end):
+        first = (self.cursor - self.count) % len(self.timestamps)
+        order = (first + np.arange(self.count)) % len(self.timestamps)
+        timestamps = self.timestamps[order]
+        mask = (timestamps >= start) & (timestamps <= end)
+        return timestamps[mask], self.values[order][mask]
+
+
+class Tier:
+
+    def __init__(self, resolution, capacity, width):
+        self.resolution = resolution
+        self.buffer = RingBuffer(capacity, width)
+        self.bucket = None
+        self.acc = np.zeros(width)
+        self.samples = np.zeros(width)
+
+    def add(self, timestamp, values):
+        if not self.resolution:
+            self.buffer.append(timestamp, values)
+            return
+        bucket = timestamp // self.resolution
+        if bucket != self.bucket:
+            self.flush()
+            self.bucket = bucket
+        valid = ~np.isnan(values)
+        self.acc[valid] += values[valid]
+        self.samples[valid] += 1
+
+    def flush(self):
+        if self.bucket is None or not self.samples.any():
+            return
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.where(self.samples > 0, self.acc / self.samples, np.nan)
+        self.buffer.append(self.bucket * self.resolution, mean)
+        self.acc[:] = 0
+        self.samples[:] = 0
+
+
+class TimeSeries:
+
+    def __init__(self, fields, tiers=DEFAULT_TIERS):
+        self.fields = fields
+        self.tiers = [Tier(resolution, capacity, len(fields)) for resolution, capacity in tiers]
+
+    def add(self, timestamp, attrs):
+        values = np.array([attrs.get(field, np.nan) for field in self.fields], dtype=float)
+        for tier in self.tiers:
+            tier.add(timestamp, values)
+
+    def get_tier(self, start):
+        # the finest tier that still reaches back to start
+        for tier in self.tiers:
+            oldest = tier.buffer.oldest()
+            if oldest is not None and oldest <= start:
+                return tier
+        for tier in reversed(self.tiers):
+            if tier.buffer.count:
+                return tier
+        return self.tiers[0]
+
+    def query(self, start, end):
+        return self.get_tier(start).buffer.select(start, end)
+
+    def aggregate(self, start, end, agg="mean"):
+        timestamps, rows = self.query(start, end)
+        if not len(rows):
+            return {"count": 0, "values": dict.fromkeys(self.fields)}
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)  # fields without any sample
+            values = AGGREGATIONS[agg](rows.astype(float), axis=0)
+        return {
+            "count": len(rows),
+            "values": {k: None if np.isnan(v) else float(v) for k, v in zip(self.fields, values)},
+        }
+
+
+class HistoryStore:
+
+    EDGE_FIELDS = ("latency", "latency_smoothed", "latency_raw", "rtt", "rtt_queue")
+    NODE_FIELDS = ("cpu", "ram", "cpu_psi", "ram_psi")
+
+    def __init__(self, tiers=DEFAULT_TIERS):
+        self.tiers = tiers
+        self.edges = {}
+        self.nodes = {}
+
+    def record_edge(self, node_id_src, node_id_dst, attrs, timestamp=None):
+        if not self.tiers:
+            return  # history disabled
+        try:
+            series = self.edges[(node_id_src, node_id_dst)]
+        except KeyError:
+            series = TimeSeries(self.EDGE_FIELDS, self.tiers)
+            self.edges[(node_id_src, node_id_dst)] = series
+        series.add(time.time() if timestamp is None else timestamp, attrs)
+
+    def record_node(self, node_id, attrs, timestamp=None):
+        if not self.tiers:
+            return
+        try:
+            series = self.nodes[node_id]
+        except KeyError:
+            series = TimeSeries(self.NODE_FIELDS, self.tiers)
+            self.nodes[node_id] = series
+        series.add(time.time() if timestamp is None else timestamp, attrs)
+
+    def query(self, start=None, end=None, agg="mean"):
+        if agg not in AGGREGATIONS:
+            raise KeyError("Unknown aggregation '%s'" % agg)
+        end = time.time() if end is None else end
+        start = end - 60 if start is None else start
+        return {
+            "start": start,
+            "end": end,
+            "agg": agg,
+            "edges": [{"src": a, "dst": b, **series.aggregate(start, end, agg)}
+                      for (a, b), series in self.edges.items()],
+            "nodes": [{"node_id": k, **series.aggregate(start, end, agg)}
+                      for k, series in self.nodes.items()],
+        }
@@ -13,13 +13,14 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import random
 import struct
 import uuid
 
 import ryu.lib.packet as packet
 from ryu.lib.packet import ether_types
 
-from nfv.monitoring.probes import ProbeMemoryCgroup, ProbeProcessorCgroup
+from nfv.monitoring.probes import ProbeSampler, get_memory_probe, get_processor_probe
 from nfv.placement.topo import NetworkModel as nm
 
 
@@ -49,6 +50,10 @@ class LLDPMonitor:
     PROJECT_OID = b'\x1e\xa5\xed'
     TLV_STATE_RTT = 1
     TLV_STATE_RTT_QUEUE = 2
+    RAW_FIELDS = {
+        TLV_STATE_RTT: "rtt",
+        TLV_STATE_RTT_QUEUE: "rtt_queue",
+    }
 
     @classmethod
     def interpret_node_id(cls, node_id):
@@ -104,9 +109,11 @@ class LLDPMonitor:
         pkt.serialize()
         return pkt
 
-    def __init__(self, period=1):
+    def __init__(self, period=1, paced=False, jitter=0.5):
         self.pool = dict()
         self.period = period
+        self.paced = paced
+        self.jitter = jitter
 
     def add(self, datapath, node_id=None):
         if datapath in self.pool:
@@ -136,9 +143,28 @@ class LLDPMonitor:
     def remove(self, datapath):
         del self.pool[datapath]
 
+    def send(self, datapath):
+        datapath.send_msg(self.pool[datapath]["msg"])
+
     def flood(self):
         for datapath in self.pool:
-            datapath.send_msg(self.pool[datapath]["msg"])
+            self.send(datapath)
+
+    def get_offsets(self, count):
+        # one slot per datapath, each probe jittered within its own slot
+        slot = self.period / max(count, 1)
+        return [slot * (i + 0.5 + self.jitter * random.uniform(-0.5, 0.5)) for i in range(count)]
+
+    def flood_paced(self, sleep):
+        datapaths = list(self.pool)
+        random.shuffle(datapaths)
+        elapsed = 0
+        for datapath, offset in zip(datapaths, self.get_offsets(len(datapaths))):
+            sleep(offset - elapsed)
+            elapsed = offset
+            if datapath in self.pool:
+                self.send(datapath)
+        sleep(max(self.period - elapsed, 0))
 
     @TLVParser(subtype=TLV_STATE_RTT, category="link", fieldname="rtt")
     def parse_tlv_rtt(self, tlv: packet.lldp.OrganizationallySpecific):
@@ -148,6 +174,69 @@ class LLDPMonitor:
     def parse_tlv_rtt_queue(self, tlv: packet.lldp.OrganizationallySpecific):
         return struct.unpack("=Q", tlv.info)[0] / 1e6
 
+    def parse_raw(self, datapath, match, data):
+        # decodes the probes without building ryu packet objects, returns
+        # None for anything unexpected so the caller can fall back to parse()
+        buf = memoryview(data)
+        size = len(buf)
+        if size < 16 or struct.unpack_from("!H", buf, 12)[0] != ether_types.ETH_TYPE_LLDP:
+            return None
+
+        chassis_id = None
+        port_id = None
+        link = {
+            "port": match["in_port"],
+            "addr": "%02x:%02x:%02x:%02x:%02x:%02x" % tuple(buf[6:12]),
+        }
+
+        offset = 14
+        while offset + 2 <= size:
+            header = struct.unpack_from("!H", buf, offset)[0]
+            tlv_type = header >> 9
+            length = header & 0x1ff
+            offset += 2
+            if offset + length > size:
+                return None
+            if tlv_type == packet.lldp.LLDP_TLV_END:
+                break
+            elif tlv_type == packet.lldp.LLDP_TLV_CHASSIS_ID:
+                if length != 9 or buf[offset] != packet.lldp.ChassisID.SUB_LOCALLY_ASSIGNED:
+                    return None
+                chassis_id = struct.unpack_from("!Q", buf, offset + 1)[0]
+            elif tlv_type == packet.lldp.LLDP_TLV_PORT_ID:
+                if length != 17 or buf[offset] != packet.lldp.PortID.SUB_LOCALLY_ASSIGNED:
+                    return None
+                port_id = bytes(buf[offset + 1:offset + 17])
+            elif tlv_type == packet.lldp.LLDP_TLV_ORGANIZATIONALLY_SPECIFIC and length >= 4 \
+                    and buf[offset:offset + 3] == self.PROJECT_OID:
+                fieldname = self.RAW_FIELDS.get(buf[offset + 3])
+                if fieldname is None or length != 12:
+                    return None  # let the registered TLVParser handle it
+                link[fieldname] = struct.unpack_from("=Q", buf, offset + 4)[0] / 1e6
+            offset += length
+
+        if chassis_id is None or port_id is None:
+            return None
+
+        node_id = chassis_id
+        node_type = nm.NODE_TYPE_SWITCH
+
+        if not node_id:
+            node_id = uuid.UUID(bytes=port_id).hex
+            node_type = nm.NODE_TYPE_WORKER
+
+        return {
+            "src": {
+                "node_id": node_id,
+                "node_type": node_type,
+            },
+            "dst": {
+                "node_id": self.pool[datapath]["node_id"],
+                "node_type": self.pool[datapath]["node_type"],
+            },
+            "link": link,
+        }
+
     def parse(self, datapath, match, eth_frame, lldp_frame):
         if lldp_frame.tlvs[0].subtype != packet.lldp.ChassisID.SUB_LOCALLY_ASSIGNED or \
            lldp_frame.tlvs[1].subtype != packet.lldp.PortID.SUB_LOCALLY_ASSIGNED:
@@ -192,13 +281,24 @@ class LLDPMonitorWorker(LLDPMonitor):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.probes = {
-            "cpu": ProbeProcessorCgroup(),
-            "ram": ProbeMemoryCgroup(),
+            "cpu": get_processor_probe(),
+            "ram": get_memory_probe(),
         }
+        self.sampler = ProbeSampler(self.probes)
+        self.vnf_sampler = None
 
-    def parse(self, *args, **kwargs):
-        attrs = super().parse(*args, **kwargs)
+    def add_probes(self, attrs):
         attrs["dst"].setdefault("probes", {})
-        for key in self.probes:
-            attrs["dst"]["probes"].update(self.probes[key].get())
+        attrs["dst"]["probes"].update(self.sampler.get())
+        if self.vnf_sampler is not None:
+            attrs["dst"]["vnfs"] = self.vnf_sampler.get()
         return attrs
+
+    def parse_raw(self, *args, **kwargs):
+        attrs = super().parse_raw(*args, **kwargs)
+        if attrs is None:
+            return None
+        return self.add_probes(attrs)
+
+    def parse(self, *args, **kwargs):
+        return self.add_probes(super().parse(*args, **kwargs))
@@ -19,8 +19,8 @@ import time
 CGROUP_BASEDIR = "/proc/1/root/sys/fs/cgroup"
 
 
-def get_cgroup_dir(name):
-    with open("/proc/self/cgroup") as fp:
+def get_cgroup_dir(name, pid="self"):
+    with open("/proc/%s/cgroup" % pid) as fp:
         for line in fp.readlines():
             if name in line:
                 path = os.sep.join((CGROUP_BASEDIR, name, line.split(":")[-1].rstrip()))
@@ -29,6 +29,59 @@ def get_cgroup_dir(name):
     raise FileExistsError("Could not find cgroup info '%s'" % name)
 
 
+def is_cgroup2():
+    return os.path.exists(CGROUP_BASEDIR + "/cgroup.controllers")
+
+
+def get_cgroup2_dir(pid="self"):
+    with open("/proc/%s/cgroup" % pid) as fp:
+        for line in fp.readlines():
+            if line.startswith("0::"):
+                path = CGROUP_BASEDIR + line[3:].rstrip()
+                if os.path.exists(path):
+                    return path
+    raise FileExistsError("Could not find cgroup v2 info")
+
+
+def parse_pressure(lines):
+    # "some avg10=0.00 avg60=0.00 avg300=0.00 total=0"
+    pressure = {}
+    for line in lines:
+        words = line.split()
+        pressure[words[0].decode()] = float(words[1].split(b"=")[1])
+    return pressure
+
+
+class ProbeFile:
+
+    def __init__(self, path, size=256):
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY)
+        self.buffers = [bytearray(size)]
+
+    def read(self):
+        # pseudo files regenerate their content when read from offset 0
+        count = os.preadv(self.fd, self.buffers, 0)
+        while count == len(self.buffers[0]):
+            self.buffers = [bytearray(2 * count)]
+            count = os.preadv(self.fd, self.buffers, 0)
+        return memoryview(self.buffers[0])[:count]
+
+    def read_int(self):
+        return int(self.read())
+
+    def read_lines(self):
+        return bytes(self.read()).splitlines()
+
+    def read_words(self):
+        return bytes(self.read()).split()
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
 class ProbeProcessorCore:
 
     PROC_STAT_KEYS = (
@@ -100,25 +153,37 @@ class ProbeProcessor:
 
 class ProbeProcessorCgroup:
 
-    def __init__(self):
+    def __init__(self, quota_interval=1):
         self.last_ts = 0
         self.last_stat = {}
         self.cgroup_dir = get_cgroup_dir("cpu,cpuacct")
+        self.usage = ProbeFile(self.cgroup_dir + "/cpuacct.usage")
+        self.usage_percpu = ProbeFile(self.cgroup_dir + "/cpuacct.usage_percpu", size=4096)
+        self.cfs_quota = ProbeFile(self.cgroup_dir + "/cpu.cfs_quota_us")
+        self.cfs_period = ProbeFile(self.cgroup_dir + "/cpu.cfs_period_us")
+        self.quota_interval = quota_interval
+        self.quota_ts = 0
+        self.quota_raw = None
+        self.quota = 1
 
     def read_usage(self):
-        with open(self.cgroup_dir + "/cpuacct.usage") as fp:
-            return {"cpu": int(fp.read())}
+        return {"cpu": self.usage.read_int()}
 
     def read_usage_percpu(self):
-        with open(self.cgroup_dir + "/cpuacct.usage_percpu") as fp:
-            return {"cpu%d" % i: int(value) for i, value in enumerate(fp.read().split())}
+        return {"cpu%d" % i: int(value) for i, value in enumerate(self.usage_percpu.read_words())}
 
     def read_quota(self):
-        with open(self.cgroup_dir + "/cpu.cfs_quota_us") as fp:
-            cfs_quota = int(fp.read())
-        with open(self.cgroup_dir + "/cpu.cfs_period_us") as fp:
-            cfs_period = int(fp.read())
-        return cfs_quota / cfs_period
+        # the quota rarely changes, so it is only re-read periodically and
+        # only parsed again when the raw contents differ
+        ts = time.monotonic()
+        if ts - self.quota_ts < self.quota_interval:
+            return self.quota
+        self.quota_ts = ts
+        raw = (bytes(self.cfs_quota.read()), bytes(self.cfs_period.read()))
+        if raw != self.quota_raw:
+            self.quota_raw = raw
+            self.quota = int(raw[0]) / int(raw[1])
+        return self.quota
 
     def get(self, rebase=True):
         q = self.read_quota()
@@ -135,17 +200,25 @@ class ProbeProcessorCgroup:
             self.last_ts = ts
         return stat_rel
 
+    def close(self):
+        for probe in (self.usage, self.usage_percpu, self.cfs_quota, self.cfs_period):
+            probe.close()
+
 
 class ProbeMemory:
 
+    def __init__(self):
+        self.meminfo = ProbeFile("/proc/meminfo", size=4096)
+
     def get(self):
-        with open("/proc/meminfo") as fp:
-            for line in fp.readlines():
-                if line.startswith("MemAvailable"):
-                    words = [word for word in line.split(" ") if word != ""]
-                    return {"ram": int(words[-2]) * 1024}
+        for line in self.meminfo.read_lines():
+            if line.startswith(b"MemAvailable"):
+                return {"ram": int(line.split()[-2]) * 1024}
         return {"ram": None}
 
+    def close(self):
+        self.meminfo.close()
+
 
 class ProbeMemoryCgroup(ProbeMemory):
 
@@ -159,33 +232,251 @@ class ProbeMemoryCgroup(ProbeMemory):
         "inactive_file"
     )
 
+    def __init__(self):
+        super().__init__()
+        path = get_cgroup_dir("memory")
+        self.limit = ProbeFile(path + "/memory.limit_in_bytes")
+        self.stat = ProbeFile(path + "/memory.stat", size=4096)
+        self.keys = {key.encode(): key for key in self.MEM_STAT_KEYS}
+
     def get(self):
         stat = dict.fromkeys(self.MEM_STAT_KEYS)
-        path = get_cgroup_dir("memory")
 
-        with open(path + "/memory.limit_in_bytes") as fp:
-            mem_limit = int(fp.readline())
+        mem_limit = self.limit.read_int()
 
         if mem_limit == self.PAGE_COUNTER_MAX:
             return super().get()
 
-        with open(path + "/memory.stat") as fp:
-            for line in fp.readlines():
-                words = line.split(" ")
-                if words[0] in self.MEM_STAT_KEYS:
-                    stat[words[0]] = int(words[1])
+        for line in self.stat.read_lines():
+            words = line.split(b" ")
+            if words[0] in self.keys:
+                stat[self.keys[words[0]]] = int(words[1])
 
         mem_used = (stat["cache"] + stat["rss"] + stat["rss_huge"]
                     - stat["inactive_anon"] - stat["inactive_file"])
 
         return {"ram": mem_limit - mem_used}
 
+    def close(self):
+        super().close()
+        self.limit.close()
+        self.stat.close()
+
+
+class ProbePressure:
+
+    def __init__(self, path):
+        try:
+            self.pressure = ProbeFile(path)
+        except OSError:
+            self.pressure = None  # kernel built without CONFIG_PSI
+
+    def get(self):
+        if self.pressure is None:
+            return {}
+        return parse_pressure(self.pressure.read_lines())
+
+    def close(self):
+        if self.pressure is not None:
+            self.pressure.close()
+
+
+class ProbeProcessorCgroup2:
+
+    def __init__(self, quota_interval=1):
+        self.last_ts = 0
+        self.last_usage = 0
+        self.cgroup_dir = get_cgroup2_dir()
+        self.stat = ProbeFile(self.cgroup_dir + "/cpu.stat")
+        self.max = ProbeFile(self.cgroup_dir + "/cpu.max")
+        self.pressure = ProbePressure(self.cgroup_dir + "/cpu.pressure")
+        self.quota_interval = quota_interval
+        self.quota_ts = 0
+        self.quota_raw = None
+        self.quota = 1
+
+    def read_usage(self):
+        for line in self.stat.read_lines():
+            if line.startswith(b"usage_usec"):
+                return int(line.split()[1]) * 1000
+        raise ValueError("Missing usage_usec in cpu.stat")
+
+    def read_quota(self):
+        ts = time.monotonic()
+        if ts - self.quota_ts < self.quota_interval:
+            return self.quota
+        self.quota_ts = ts
+        raw = bytes(self.max.read())
+        if raw != self.quota_raw:
+            self.quota_raw = raw
+            quota, period = raw.split()
+            self.quota = -1 if quota == b"max" else int(quota) / int(period)
+        return self.quota
+
+    def get(self, rebase=True):
+        q = self.read_quota()
+        if q <= 0:
+            q = 1
+        ts = time.time_ns()
+        usage = self.read_usage()
+        stat = {
+            "cpu": 100 * (usage - self.last_usage) / (q * (ts - self.last_ts)),
+            "cpu_psi": self.pressure.get().get("some"),
+        }
+        if rebase:
+            self.last_usage = usage
+            self.last_ts = ts
+        return stat
+
+    def close(self):
+        for probe in (self.stat, self.max, self.pressure):
+            probe.close()
+
+
+class ProbeMemoryCgroup2(ProbeMemory):
+
+    def __init__(self):
+        super().__init__()
+        path = get_cgroup2_dir()
+        self.current = ProbeFile(path + "/memory.current")
+        self.max = ProbeFile(path + "/memory.max")
+        self.pressure = ProbePressure(path + "/memory.pressure")
+
+    def get(self):
+        pressure = self.pressure.get()
+        stat = {
+            "ram_psi": pressure.get("some"),
+            "ram_psi_full": pressure.get("full"),
+        }
+        mem_limit = bytes(self.max.read()).strip()
+        if mem_limit == b"max":
+            stat.update(super().get())
+        else:
+            stat["ram"] = int(mem_limit) - self.current.read_int()
+        return stat
+
+    def close(self):
+        super().close()
+        for probe in (self.current, self.max, self.pressure):
+            probe.close()
+
+
+class ProbeContainer:
+
+    def __init__(self, key, pid, iface="eth0"):
+        self.key = key
+        self.iface = iface.encode() + b":"
+        self.last_ts = time.time_ns()
+        if is_cgroup2():
+            path = get_cgroup2_dir(pid)
+            self.usage = ProbeFile(path + "/cpu.stat")
+            self.memory = ProbeFile(path + "/memory.current")
+        else:
+            self.usage = ProbeFile(get_cgroup_dir("cpu,cpuacct", pid) + "/cpuacct.usage")
+            self.memory = ProbeFile(get_cgroup_dir("memory", pid) + "/memory.usage_in_bytes")
+        self.net_dev = ProbeFile("/proc/%d/net/dev" % pid, size=4096)
+        self.last_stat = self.read()
+
+    def read_usage(self):
+        data = self.usage.read()
+        if data[:10] != b"usage_usec":
+            return int(data)
+        return int(bytes(data).split(b"\n", 1)[0].split()[1]) * 1000
+
+    def read_net_dev(self):
+        for line in self.net_dev.read_lines():
+            line = line.strip()
+            if line.startswith(self.iface):
+                words = line[len(self.iface):].split()
+                return int(words[0]), int(words[8])
+        return 0, 0
+
+    def read(self):
+        rx, tx = self.read_net_dev()
+        return {"cpu": self.read_usage(), "rx": rx, "tx": tx}
+
+    def get(self, rebase=True):
+        try:
+            ts = time.time_ns()
+            stat = self.read()
+            ram = self.memory.read_int()
+        except OSError:
+            return {}  # the container is gone
+        dt = ts - self.last_ts
+        probes = {
+            "cpu": 100 * (stat["cpu"] - self.last_stat["cpu"]) / dt,
+            "ram": ram,
+            "rx": 1e9 * (stat["rx"] - self.last_stat["rx"]) / dt,
+            "tx": 1e9 * (stat["tx"] - self.last_stat["tx"]) / dt,
+        }
+        if rebase:
+            self.last_stat = stat
+            self.last_ts = ts
+        return {self.key: probes}
+
+    def close(self):
+        for probe in (self.usage, self.memory, self.net_dev):
+            probe.close()
+
+
+class ProbeSampler:
+
+    def __init__(self, probes, period=0.5):
+        self.probes = probes
+        self.period = period
+        self.running = False
+        self.error = None
+        # no sample yet, the age counts from the creation of the sampler
+        self.latest = (time.time(), {})
+
+    def sample(self):
+        snapshot = {}
+        for key in self.probes:
+            snapshot.update(self.probes[key].get())
+        # replacing the tuple in one assignment is atomic, readers always
+        # see a consistent snapshot without taking a lock
+        self.latest = (time.time(), snapshot)
+
+    def get(self):
+        timestamp, snapshot = self.latest
+        return {**snapshot, "age": time.time() - timestamp}
+
+    def run(self, sleep):
+        self.running = True
+        while self.running:
+            try:
+                self.sample()
+                self.error = None
+            except Exception as err:
+                # keep sampling, the last good snapshot just keeps aging
+                if repr(err) != self.error:
+                    self.error = repr(err)
+                    print("Probe sampling failed: %s" % self.error)
+            sleep(self.period)
+
+    def close(self):
+        self.running = False
+        for key in self.probes:
+            self.probes[key].close()
+
+
+def get_processor_probe():
+    if is_cgroup2():
+        return ProbeProcessorCgroup2()
+    return ProbeProcessorCgroup()
+
+
+def get_memory_probe():
+    if is_cgroup2():
+        return ProbeMemoryCgroup2()
+    return ProbeMemoryCgroup()
+
 
 if __name__ == "__main__":
     import json
     try:
-        cpu = ProbeProcessorCgroup()
-        ram = ProbeMemoryCgroup()
+        cpu = get_processor_probe()
+        ram = get_memory_probe()
         while True:
             time.sleep(0.5)
             info = {
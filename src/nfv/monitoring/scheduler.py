@@ -0,0 +1,174 @@
+# Copyright (C) 2019 Patrick Ziegler
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import time
+
+
+class EdgeStats:
+
+    def __init__(self, alpha, floor):
+        self.alpha = alpha
+        self.floor = floor
+        self.mean = None
+        self.var = 0.0
+
+    def update(self, value):
+        if self.mean is None:
+            self.mean = value
+            return
+        delta = value - self.mean
+        self.mean += self.alpha * delta
+        self.var = (1 - self.alpha) * (self.var + self.alpha * delta ** 2)
+
+    @property
+    def cv(self):
+        if self.mean is None:
+            return float("inf")
+        # latencies close to zero would make any jitter look unstable
+        return self.var ** 0.5 / max(abs(self.mean), self.floor)
+
+
+class TokenBucket:
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = rate if burst is None else burst
+        self.tokens = self.burst
+        self.timestamp = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.timestamp) * self.rate)
+        self.timestamp = now
+
+    def take(self, now, count=1):
+        self.refill(now)
+        if self.tokens < count:
+            return False
+        self.tokens -= count
+        return True
+
+
+class ProbeScheduler:
+
+    def __init__(self, period_min=1.0, period_max=10.0, budget=None,
+                 cv_low=0.05, cv_high=0.2, backoff=1.5, alpha=0.2, floor=1.0, boost_duration=10):
+        self.period_min = period_min
+        self.period_max = period_max
+        self.cv_low = cv_low
+        self.cv_high = cv_high
+        self.backoff = backoff
+        self.alpha = alpha
+        self.floor = floor
+        self.boost_duration = boost_duration
+        self.bucket = None
+        self.budget = budget
+        self.nodes = dict()
+        self.stats = dict()
+
+    @property
+    def budget(self):
+        return None if self.bucket is None else self.bucket.rate
+
+    @budget.setter
+    def budget(self, value):
+        # None disables the packet-out cap
+        self.bucket = None if value is None else TokenBucket(value)
+
+    def add(self, node_id):
+        if node_id in self.nodes:
+            return
+        self.nodes[node_id] = {
+            "interval": self.period_min,
+            "due": time.monotonic(),
+            "boost": 0,
+        }
+        self.stats[node_id] = dict()
+
+    def remove(self, node_id):
+        self.nodes.pop(node_id, None)
+        self.stats.pop(node_id, None)
+
+    def observe(self, node_id_src, node_id_dst, value):
+        try:
+            stats = self.stats[node_id_src]
+        except KeyError:
+            return  # not probed by this scheduler
+        try:
+            stats[node_id_dst].update(value)
+        except KeyError:
+            stats[node_id_dst] = EdgeStats(self.alpha, self.floor)
+            stats[node_id_dst].update(value)
+
+    def boost(self, node_ids, duration=None):
+        until = time.monotonic() + (self.boost_duration if duration is None else duration)
+        for node_id in node_ids:
+            if node_id in self.nodes:
+                node = self.nodes[node_id]
+                node["boost"] = max(node["boost"], until)
+                node["due"] = min(node["due"], time.monotonic() + self.period_min)
+
+    def get_cv(self, node_id):
+        stats = self.stats[node_id]
+        if not stats:
+            return float("inf")
+        return max(e.cv for e in stats.values())
+
+    def reschedule(self, node_id, now):
+        node = self.nodes[node_id]
+        cv = self.get_cv(node_id)
+        if node["boost"] > now or cv > self.cv_high:
+            node["interval"] = self.period_min
+        elif cv < self.cv_low:
+            node["interval"] = min(self.period_max, node["interval"] * self.backoff)
+        node["interval"] = max(self.period_min, node["interval"])
+        node["due"] = now + node["interval"]
+
+    def due(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        # most overdue first, the rest waits for the budget to refill
+        pending = sorted((e["due"], k) for k, e in self.nodes.items() if e["due"] <= now)
+        selected = []
+        for _, node_id in pending:
+            if self.bucket is not None and not self.bucket.take(now):
+                break
+            self.reschedule(node_id, now)
+            selected.append(node_id)
+        return selected
+
+    def sleep_time(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        if not self.nodes:
+            return self.period_min
+        wait = min(e["due"] for e in self.nodes.values()) - now
+        if self.bucket is not None and self.bucket.tokens < 1:
+            wait = max(wait, (1 - self.bucket.tokens) / self.bucket.rate)
+        return min(max(wait, 0.0), self.period_min)
+
+    def as_dict(self):
+        now = time.monotonic()
+        return {
+            "period_min": self.period_min,
+            "period_max": self.period_max,
+            "budget": self.budget,
+            "nodes": {
+                str(k): {
+                    "interval": e["interval"],
+                    "cv": self.get_cv(k),
+                    "boosted": e["boost"] > now,
+                } for k, e in self.nodes.items()
+            },
+        }
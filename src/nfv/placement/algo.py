@@ -13,17 +13,68 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import copy
 import itertools
 import random
+from functools import partial
 from abc import abstractmethod
 
 import networkx as nx
+import numpy as np
 
+from nfv.placement.topo import LatencyMatrix
 from nfv.placement.topo import NetworkModel as nm
 
 
+def get_graph(model):
+    if isinstance(model, nm):
+        return model.model
+    return model
+
+
+def get_matrix(model):
+    if isinstance(model, nm):
+        return model.matrix
+    return LatencyMatrix.from_graph(model)
+
+
+def get_shortest_paths(model, source):
+    if isinstance(model, nm):
+        return model.get_shortest_paths(source)
+    return nx.single_source_dijkstra(G=model, source=source, weight="latency")
+
+
+def build_mesh(model, node_src, node_dst):
+    graph = get_graph(model)
+    mesh = nx.DiGraph()
+    mesh.add_nodes_from(
+        [e for e in graph.nodes(data=True) if e[1]["node_type"] == nm.NODE_TYPE_WORKER]
+    )
+    mesh.add_nodes_from(
+        nx.subgraph(graph, [node_src, node_dst]).nodes(data=True)
+    )
+    mesh_costs = {}
+    mesh_paths = {}
+    for node in mesh:
+        mesh_costs[node], mesh_paths[node] = get_shortest_paths(model, node)
+    for node_a in mesh:
+        for node_b in mesh:
+            mesh.add_edge(node_a, node_b, latency=mesh_costs[node_a][node_b])
+    return mesh, mesh_costs, mesh_paths
+
+
+def get_mesh(model, node_src, node_dst):
+    if isinstance(model, nm):
+        return model.get_cached(("mesh", node_src, node_dst),
+                                partial(build_mesh, model, node_src, node_dst))
+    return build_mesh(model, node_src, node_dst)
+
+
 class AbstractPlacement:
 
+    cacheable = True
+    params = ()
+
     def __init__(self, node_src, node_dst, chain_length):
         self.node_src = node_src
         self.node_dst = node_dst
@@ -39,16 +90,36 @@ class AbstractPlacement:
     def calc(self):
         pass
 
+    def snapshot(self):
+        return self
+
+    def split(self):
+        return [self]
+
+    def get_cache_key(self, model):
+        if not self.cacheable:
+            return None
+        return (
+            self.__class__.__name__,
+            self.node_src,
+            self.node_dst,
+            self.chain_length,
+            tuple(getattr(self, param) for param in self.params),
+            getattr(model, "epoch", None),
+        )
+
 
 class RandomPlacement(AbstractPlacement):
 
+    cacheable = False
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.workers = None
 
     def prepare(self, model):
-        self.model = model
-        self.workers = [e[0] for e in model.nodes(data=True)
+        self.model = get_graph(model)
+        self.workers = [e[0] for e in self.model.nodes(data=True)
                         if e[1]["node_type"] == nm.NODE_TYPE_WORKER]
 
     def calc(self):
@@ -68,33 +139,43 @@ class RandomPlacement(AbstractPlacement):
 
 class HastyTraveller(AbstractPlacement):
 
+    params = ("limit",)
+
     def __init__(self, *args, limit=3, **kwargs):
         super().__init__(*args, **kwargs)
         self.tabu = [self.node_dst]
         self.limit = limit
+        self.branch = None
         self.mesh = None
         self.mesh_costs = None
         self.mesh_paths = None
 
     def prepare(self, model):
-        self.mesh = nx.DiGraph()
-        self.mesh.add_nodes_from(
-            [e for e in model.nodes(data=True) if e[1]["node_type"] == nm.NODE_TYPE_WORKER]
-        )
-        self.mesh.add_nodes_from(
-            nx.subgraph(model, [self.node_src, self.node_dst]).nodes(data=True)
-        )
-        self.mesh_costs = {}
-        self.mesh_paths = {}
-        for node in self.mesh:
-            self.mesh_costs[node], self.mesh_paths[node] = nx.single_source_dijkstra(
-                G=model,
-                source=node,
-                weight="latency"
-            )
-        for node_a in self.mesh:
-            for node_b in self.mesh:
-                self.mesh.add_edge(node_a, node_b, latency=self.mesh_costs[node_a][node_b])
+        # the mesh is shared between placements of the same epoch, calc() only reads it
+        self.mesh, self.mesh_costs, self.mesh_paths = get_mesh(model, self.node_src, self.node_dst)
+
+    def snapshot(self):
+        # only distances and paths between mesh nodes are needed by calc()
+        obj = copy.copy(self)
+        obj.tabu = list(self.tabu)
+        nodes = set(self.mesh)
+        obj.mesh_costs = {u: {v: c for v, c in self.mesh_costs[u].items() if v in nodes}
+                          for u in nodes}
+        obj.mesh_paths = {u: {v: p for v, p in self.mesh_paths[u].items() if v in nodes}
+                          for u in nodes}
+        return obj
+
+    def split(self):
+        adj = self.mesh.adj[self.node_src]
+        neighs = sorted([e for e in adj if e not in (self.node_src, *self.tabu)],
+                        key=lambda item: adj[item]["latency"])
+        branches = []
+        for neigh in neighs[:self.limit]:
+            branch = copy.copy(self)
+            branch.tabu = list(self.tabu)
+            branch.branch = neigh
+            branches.append(branch)
+        return branches or [self]
 
     def calc(self):
 
@@ -105,6 +186,8 @@ class HastyTraveller(AbstractPlacement):
             submesh = nx.subgraph(self.mesh, [e for e in self.mesh if e not in self.tabu])
             keys = sorted(submesh.adj[node], key=lambda item: submesh.adj[node][item]["latency"])
             neighs = [(k, submesh.adj[node][k]["latency"]) for k in keys if k != node]
+            if self.branch is not None and level == self.chain_length:
+                neighs = [e for e in neighs if e[0] == self.branch]
             self.tabu.append(node)
             for i in range(min(len(neighs), self.limit)):
                 neigh = neighs[i][0]
@@ -126,3 +209,153 @@ class HastyTraveller(AbstractPlacement):
         self.paths = [self.mesh_paths[u][v] for u, v in zip(a, b)]
         self.expected_latency = cost
         return self.paths, {"latency": self.expected_latency}
+
+
+class ExactPlacement(AbstractPlacement):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.matrix = None
+        self.workers = None
+        self.node_costs = None
+        self.cost_src = None
+        self.cost_dst = None
+        self.cost_mesh = None
+
+    def get_node_costs(self, graph, workers):
+        return np.zeros(len(workers))
+
+    def prepare(self, model):
+        graph = get_graph(model)
+        self.matrix = get_matrix(model)
+        dist, _ = self.matrix.shortest_paths()
+        workers = [e[0] for e in graph.nodes(data=True)
+                   if e[1]["node_type"] == nm.NODE_TYPE_WORKER]
+        node_costs = self.get_node_costs(graph, workers)
+        feasible = np.isfinite(node_costs)
+        self.workers = [w for w, f in zip(workers, feasible) if f]
+        self.node_costs = node_costs[feasible]
+        idx = np.array([self.matrix.index[w] for w in self.workers], dtype=np.int64)
+        i_src = self.matrix.index[self.node_src]
+        i_dst = self.matrix.index[self.node_dst]
+        self.cost_src = dist[i_src, idx]
+        self.cost_dst = dist[idx, i_dst]
+        self.cost_mesh = dist[np.ix_(idx, idx)]
+        np.fill_diagonal(self.cost_mesh, np.inf)  # a worker is visited only once
+
+    def snapshot(self):
+        obj = copy.copy(self)
+        obj.matrix = self.matrix.snapshot()
+        return obj
+
+    def calc(self):
+        n = len(self.workers)
+        k = self.chain_length
+        if k > n:
+            raise ValueError("Chain of length %d does not fit on %d workers" % (k, n))
+
+        # entering a worker costs the link latency plus its node cost
+        enter_src = self.cost_src + self.node_costs
+        enter_mesh = self.cost_mesh + self.node_costs[None, :]
+
+        # bound[r][w] is the cheapest way from w to the destination over r
+        # more workers when workers may be revisited, so it never overestimates
+        bound = [self.cost_dst]
+        for r in range(1, k):
+            bound.append(np.min(enter_mesh + bound[r - 1][None, :], axis=1))
+        order = [None] + [np.argsort(enter_mesh + bound[r - 1][None, :], axis=1)
+                          for r in range(1, k)]
+
+        best = [np.inf, None]
+        visited = np.zeros(n, dtype=bool)
+        seq = []
+
+        def _branch(node, remaining, cost):
+            if remaining == 0:
+                total = cost + self.cost_dst[node]
+                if total < best[0]:
+                    best[0] = total
+                    best[1] = list(seq)
+                return
+            row = enter_mesh[node] + bound[remaining - 1]
+            for neigh in order[remaining][node]:
+                if cost + row[neigh] >= best[0]:
+                    break  # candidates are sorted, so all remaining ones are worse
+                if visited[neigh]:
+                    continue
+                visited[neigh] = True
+                seq.append(neigh)
+                _branch(neigh, remaining - 1, cost + enter_mesh[node, neigh])
+                seq.pop()
+                visited[neigh] = False
+
+        if k == 0:
+            best = [self.matrix.shortest_paths()[0][self.matrix.index[self.node_src],
+                                                    self.matrix.index[self.node_dst]], []]
+        else:
+            row = enter_src + bound[k - 1]
+            for node in np.argsort(row):
+                if row[node] >= best[0]:
+                    break
+                visited[node] = True
+                seq.append(node)
+                _branch(node, k - 1, enter_src[node])
+                seq.pop()
+                visited[node] = False
+
+        if not np.isfinite(best[0]):
+            raise ValueError("No feasible placement from %s to %s" % (self.node_src, self.node_dst))
+
+        nodes = [self.node_src, *[self.workers[i] for i in best[1]], self.node_dst]
+        a, b = itertools.tee(nodes)
+        next(b)
+        self.paths = [self.matrix.get_path(u, v) for u, v in zip(a, b)]
+        dist, _ = self.matrix.shortest_paths()
+        self.expected_latency = float(sum(
+            dist[self.matrix.index[u], self.matrix.index[v]] for u, v in zip(nodes, nodes[1:])
+        ))
+        return self.paths, {"latency": self.expected_latency, "cost": float(best[0])}
+
+
+class CapacityAwarePlacement(ExactPlacement):
+
+    cacheable = False  # probes and load change independently of the topology epoch
+
+    def __init__(self, *args, weight=1.0, cpu_max=90, cpu_per_vnf=10,
+                 ram_min=64 * 2**20, ram_per_vnf=64 * 2**20, psi_weight=1.0, max_age=None,
+                 **kwargs):
+        super().__init__(*args, **kwargs)
+        self.weight = weight
+        self.psi_weight = psi_weight
+        self.max_age = max_age
+        self.cpu_max = cpu_max
+        self.cpu_per_vnf = cpu_per_vnf
+        self.ram_min = ram_min
+        self.ram_per_vnf = ram_per_vnf
+        self.load = None
+
+    def prepare(self, model):
+        self.load = model.load if isinstance(model, nm) else {}
+        super().prepare(model)
+
+    def get_node_costs(self, graph, workers):
+        costs = np.zeros(len(workers))
+        for i, node in enumerate(workers):
+            probes = graph.nodes[node].get("probes", {})
+            if self.max_age is not None and probes.get("age", 0) > self.max_age:
+                probes = {}  # stale samples, rely on the reserved load only
+            load = self.load.get(node, 0) + 1  # including the vnf to be placed
+            cpu = probes.get("cpu", 0) + load * self.cpu_per_vnf
+            ram = probes.get("ram")
+            if ram is not None and ram - load * self.ram_per_vnf < self.ram_min:
+                costs[i] = np.inf
+            elif cpu >= self.cpu_max:
+                costs[i] = np.inf
+            else:
+                # queueing delay grows like u / (1 - u) towards saturation
+                util = cpu / self.cpu_max
+                costs[i] = self.weight * util / (1 - util)
+                # share of time tasks were stalled on cpu or memory (cgroup v2 only)
+                stall = (probes.get("cpu_psi") or 0) + (probes.get("ram_psi") or 0)
+                costs[i] += self.psi_weight * stall / 100
+        return costs
@@ -0,0 +1,64 @@
+# Copyright (C) 2019 Patrick Ziegler
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+
+def calc_placement(placement):
+    placement.calc()
+    return placement.paths, placement.expected_latency
+
+
+class PlacementExecutor:
+
+    def __init__(self, max_workers=None, poll=0.005, sleep=time.sleep):
+        self.max_workers = max_workers
+        self.poll = poll
+        self.sleep = sleep
+        self.pool = ProcessPoolExecutor(max_workers=max_workers)
+
+    def wait(self, future):
+        # the controller passes hub.sleep, so other greenthreads keep running
+        # while the pool computes
+        while not future.done():
+            self.sleep(self.poll)
+        return future.result()
+
+    def submit(self, placement):
+        return [self.pool.submit(calc_placement, branch.snapshot()) for branch in placement.split()]
+
+    def collect(self, placement, futures):
+        results = []
+        error = None
+        for future in futures:
+            try:
+                results.append(self.wait(future))
+            except (IndexError, KeyError, ValueError) as err:
+                error = err  # a branch without any feasible placement
+        if not results:
+            raise error
+        placement.paths, placement.expected_latency = min(results, key=lambda e: e[1])
+        return placement.paths, {"latency": placement.expected_latency}
+
+    def calc(self, placement):
+        return self.collect(placement, self.submit(placement))
+
+    def calc_many(self, placements):
+        futures = [self.submit(placement) for placement in placements]
+        return [self.collect(placement, f) for placement, f in zip(placements, futures)]
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
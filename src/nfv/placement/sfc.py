@@ -13,13 +13,120 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import heapq
 import importlib
 import json
-import random
+import time
+
+
+class LabelAllocator:
+
+    LABEL_MIN = 16  # labels 0 - 15 are reserved
+    LABEL_MAX = 0xfffff  # mpls labels are 20 bit
+
+    def __init__(self, start=LABEL_MIN, stop=LABEL_MAX + 1):
+        if start < self.LABEL_MIN or stop > self.LABEL_MAX + 1 or start >= stop:
+            raise ValueError("Invalid label range [%d, %d)" % (start, stop))
+        self.start = start
+        self.stop = stop
+        self.bitmap = bytearray((stop - start + 7) // 8)
+        self.free = []  # heap of (reusable after, label)
+        self.cursor = start
+        self.count = 0
+        self.children = []
+
+    def __contains__(self, label):
+        if self.children:
+            return any(label in child for child in self.children)
+        i = label - self.start
+        return 0 <= i < self.stop - self.start and bool(self.bitmap[i >> 3] & (1 << (i & 7)))
+
+    def __len__(self):
+        if self.children:
+            return sum(len(child) for child in self.children)
+        return self.count
+
+    def _set(self, label):
+        i = label - self.start
+        self.bitmap[i >> 3] |= 1 << (i & 7)
+        self.count += 1
+
+    def _clear(self, label):
+        i = label - self.start
+        self.bitmap[i >> 3] &= ~(1 << (i & 7)) & 0xff
+        self.count -= 1
+
+    def check_partitioned(self):
+        if self.children:
+            raise ValueError("Label range [%d, %d) has been partitioned" % (self.start, self.stop))
+
+    def allocate(self):
+        self.check_partitioned()
+        # fresh labels first, released ones might still be referenced by
+        # flows and vnfs that have not timed out yet
+        while self.cursor < self.stop:
+            label = self.cursor
+            self.cursor += 1
+            if label not in self:
+                self._set(label)
+                return label
+        now = time.monotonic()
+        while self.free and self.free[0][0] <= now:
+            label = heapq.heappop(self.free)[1]
+            if label not in self:
+                self._set(label)
+                return label
+        raise ValueError("MPLS label space [%d, %d) exhausted" % (self.start, self.stop))
+
+    def reserve(self, label):
+        self.check_partitioned()
+        if not self.start <= label < self.stop:
+            raise ValueError("Label %d is out of range [%d, %d)" % (label, self.start, self.stop))
+        if label in self:
+            raise ValueError("Label %d is already in use" % label)
+        self._set(label)
+
+    def release(self, label, hold=0):
+        for child in self.children:
+            if child.start <= label < child.stop:
+                return child.release(label, hold)
+        if label not in self:
+            raise KeyError(label)
+        self._clear(label)
+        heapq.heappush(self.free, (time.monotonic() + hold, label))
+
+    def partition(self, n):
+        # the parent hands its whole range over to the children, labels that
+        # are already in use stay reserved in the child owning them
+        self.check_partitioned()
+        size = (self.stop - self.start) // n
+        children = [self.__class__(self.start + i * size,
+                                   self.stop if i == n - 1 else self.start + (i + 1) * size)
+                    for i in range(n)]
+        for i, bits in enumerate(self.bitmap):
+            for j in range(8) if bits else ():
+                if bits & (1 << j):
+                    label = self.start + 8 * i + j
+                    children[min((label - self.start) // size, n - 1)].reserve(label)
+        self.children = children
+        return children
+
+
+LABELS = LabelAllocator()
+
+PLACEMENT_CLASSES = {}
 
 
 def get_id():
-    return random.randint(0, 0xfffff)  # mpls labels are 20 bit
+    return LABELS.allocate()
+
+
+def get_placement_cls(name):
+    try:
+        return PLACEMENT_CLASSES[name]
+    except KeyError:
+        PLACEMENT_CLASSES[name] = getattr(importlib.import_module("nfv.placement.algo"), name)
+        return PLACEMENT_CLASSES[name]
 
 
 class ServiceHook:
@@ -30,6 +137,10 @@ class ServiceHook:
         self.src_dp = src_dp
         self.dst_dp = dst_dp
 
+    @property
+    def key(self):
+        return self.src_ip, self.dst_ip
+
     def __eq__(self, other):
         try:
             if self.src_ip == other.src_ip and self.dst_ip == other.dst_ip:
@@ -39,6 +150,9 @@ class ServiceHook:
         except AttributeError:
             return False
 
+    def __hash__(self):
+        return hash(self.key)
+
     def as_dict(self):
         return {
             "src_ip": self.src_ip,
@@ -48,13 +162,16 @@ class ServiceHook:
         }
 
     @classmethod
-    def from_json(cls, msg):
-        nsd = json.loads(msg)
+    def from_dict(cls, nsd):
         return cls(
             src_ip=nsd["hook"]["src_ip"],
             dst_ip=nsd["hook"]["dst_ip"],
         )
 
+    @classmethod
+    def from_json(cls, msg):
+        return cls.from_dict(json.loads(msg))
+
 
 class ServiceFunction:
 
@@ -106,19 +223,53 @@ class ServiceFunction:
 
 class ServiceFunctionChain:
 
-    def __init__(self, hook, placement, immediate, timeout):
-        self.label = get_id()
+    def __init__(self, hook, placement, immediate, timeout, proactive=False, labels=LABELS):
+        self.labels = labels
+        self.label = labels.allocate()
         self.hook = hook
         self.placement = placement
-        self.immediate = immediate
+        self.immediate = immediate or proactive
         self.timeout = timeout
+        self.proactive = proactive
+        self.install_latency = None
         self.jobs = []
 
-    def embedding(self, model):
-        self.placement.prepare(model)
-        self.placement.calc()
+    def embedding(self, model, cache=None, executor=None):
+        self.place(model, cache, executor)
+        self.assign(model)
+
+    def place(self, model, cache=None, executor=None):
+        # only computes the paths, the model is not touched until assign()
+        key = None if cache is None else self.placement.get_cache_key(model)
+        cached = None if key is None else cache.get(key)
+        if cached is None:
+            self.placement.prepare(model)
+            if executor is None:
+                self.placement.calc()
+            else:
+                executor.calc(self.placement)
+            if key is not None:
+                cache.put(key, (self.placement.paths, self.placement.expected_latency))
+        else:
+            self.placement.paths, self.placement.expected_latency = cached
+
+    def assign(self, model):
+        model.free(self.get_nodes())
         for i in range(len(self.placement.paths) - 1):
             self.jobs[i].node_id = self.placement.paths[i][-1]
+        model.reserve(self.get_nodes())
+
+    def get_nodes(self):
+        return [vnf.node_id for vnf in self.jobs if vnf.node_id is not None]
+
+    def release(self):
+        # keep the labels quarantined until the routes and vnfs using them expired
+        hold = round(1.1 * self.timeout)
+        for label in (self.label, *[vnf.label_out for vnf in self.jobs]):
+            try:
+                self.labels.release(label, hold)
+            except KeyError:
+                pass
 
     def get_paths(self):
         labels = [self.label, *[e.label_out for e in self.jobs]]
@@ -136,18 +287,24 @@ class ServiceFunctionChain:
             "placement": {
                 "paths": self.placement.paths,
                 "expected_latency": self.placement.expected_latency,
+                "install_latency": self.install_latency,
             },
             "immediate": self.immediate,
             "timeout": self.timeout,
+            "proactive": self.proactive,
             "jobs": [job.as_dict() for job in self.jobs],
         }
 
     @classmethod
-    def from_json(cls, msg, ip_to_dp):
-        nsd = json.loads(msg)
+    def from_json(cls, msg, ip_to_dp, labels=LABELS):
+        return cls.from_dict(json.loads(msg), ip_to_dp, labels)
+
+    @classmethod
+    def from_dict(cls, nsd, ip_to_dp, labels=LABELS):
         nsd.setdefault("placement", {})
         nsd["placement"].setdefault("immediate", False)
         nsd["placement"].setdefault("timeout", 30)
+        nsd["placement"].setdefault("proactive", False)
         nsd["placement"].setdefault("algorithm", {"name": "RandomPlacement", "kwargs": {}})
         nsd["placement"]["algorithm"].setdefault("kwargs", {})
         hook = ServiceHook(
@@ -156,10 +313,7 @@ class ServiceFunctionChain:
             src_dp=ip_to_dp[nsd["hook"]["src_ip"]],
             dst_dp=ip_to_dp[nsd["hook"]["dst_ip"]],
         )
-        placement_cls = getattr(
-            importlib.import_module("nfv.placement.algo"),
-            nsd["placement"]["algorithm"]["name"]
-        )
+        placement_cls = get_placement_cls(nsd["placement"]["algorithm"]["name"])
         placement = placement_cls(
             node_src=ip_to_dp[nsd["hook"]["src_ip"]].id,
             node_dst=ip_to_dp[nsd["hook"]["dst_ip"]].id,
@@ -171,20 +325,26 @@ class ServiceFunctionChain:
             placement=placement,
             immediate=nsd["placement"]["immediate"],
             timeout=nsd["placement"]["timeout"],
+            proactive=nsd["placement"]["proactive"],
+            labels=labels,
         )
         last_label = sfc.label
-        for job in nsd["jobs"]:
-            job.setdefault("param", None)
-            job.setdefault("public", False)
-            vnf = ServiceFunction(
-                image=job["name"],
-                label_in=last_label,
-                label_out=get_id(),
-                param=job["param"],
-                public=job["public"],
-                immediate=sfc.immediate,
-                timeout=round(1.1 * sfc.timeout),  # +10% timeout for safety
-            )
-            sfc.jobs.append(vnf)
-            last_label = vnf.label_out
+        try:
+            for job in nsd["jobs"]:
+                job.setdefault("param", None)
+                job.setdefault("public", False)
+                vnf = ServiceFunction(
+                    image=job["name"],
+                    label_in=last_label,
+                    label_out=labels.allocate(),
+                    param=job["param"],
+                    public=job["public"],
+                    immediate=sfc.immediate,
+                    timeout=round(1.1 * sfc.timeout),  # +10% timeout for safety
+                )
+                sfc.jobs.append(vnf)
+                last_label = vnf.label_out
+        except Exception:
+            sfc.release()
+            raise
         return sfc
@@ -16,6 +16,116 @@
 import json
 
 import networkx as nx
+import numpy as np
+
+from nfv.monitoring.filters import get_estimator_factory
+from nfv.monitoring.history import DEFAULT_TIERS, HistoryStore
+
+NO_PREDECESSOR = -9999
+
+
+def floyd_warshall(latency):
+    n = latency.shape[0]
+    dist = latency.copy()
+    np.fill_diagonal(dist, 0)
+    pred = np.where(np.isfinite(latency), np.arange(n)[:, None], NO_PREDECESSOR)
+    np.fill_diagonal(pred, NO_PREDECESSOR)
+    for k in range(n):
+        alt = dist[:, k, None] + dist[None, k, :]
+        better = alt < dist
+        dist = np.where(better, alt, dist)
+        pred = np.where(better, pred[None, k, :], pred)
+    return dist, pred
+
+
+def all_pairs_shortest_paths(latency):
+    try:
+        from scipy.sparse.csgraph import csgraph_from_dense, shortest_path
+    except ImportError:
+        return floyd_warshall(latency)
+    graph = csgraph_from_dense(latency, null_value=np.inf)
+    return shortest_path(graph, method="auto", directed=True, return_predecessors=True)
+
+
+class LatencyMatrix:
+
+    def __init__(self, capacity=16):
+        self.index = {}
+        self.nodes = []
+        self.latency = np.full((capacity, capacity), np.inf)
+        self.rtt = np.full((capacity, capacity), np.nan)
+        self.port = np.full((capacity, capacity), -1, dtype=np.int64)
+        self.dist = None
+        self.pred = None
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def grow(self, capacity):
+        n = self.latency.shape[0]
+        for name, fill in (("latency", np.inf), ("rtt", np.nan), ("port", -1)):
+            old = getattr(self, name)
+            new = np.full((capacity, capacity), fill, dtype=old.dtype)
+            new[:n, :n] = old
+            setattr(self, name, new)
+
+    def get_index(self, node_id):
+        try:
+            return self.index[node_id]
+        except KeyError:
+            if len(self.nodes) == self.latency.shape[0]:
+                self.grow(2 * self.latency.shape[0])
+            self.index[node_id] = len(self.nodes)
+            self.nodes.append(node_id)
+            return self.index[node_id]
+
+    def set_edge(self, node_src, node_dst, latency, rtt=np.nan, port=-1):
+        i = self.get_index(node_src)
+        j = self.get_index(node_dst)
+        if self.latency[i, j] != latency:
+            self.dist = None
+            self.pred = None
+        self.latency[i, j] = latency
+        self.rtt[i, j] = rtt
+        self.port[i, j] = port
+
+    def shortest_paths(self):
+        if self.dist is None:
+            n = len(self.nodes)
+            self.dist, self.pred = all_pairs_shortest_paths(self.latency[:n, :n])
+        return self.dist, self.pred
+
+    def get_path(self, node_src, node_dst):
+        _, pred = self.shortest_paths()
+        i = self.index[node_src]
+        j = self.index[node_dst]
+        path = [node_dst]
+        while j != i:
+            j = pred[i, j]
+            if j == NO_PREDECESSOR:
+                raise KeyError("No path from %s to %s" % (node_src, node_dst))
+            path.append(self.nodes[j])
+        return path[::-1]
+
+    def snapshot(self):
+        # keeps only what is needed to look up distances and paths
+        dist, pred = self.shortest_paths()
+        obj = self.__class__(capacity=0)
+        obj.index = dict(self.index)
+        obj.nodes = list(self.nodes)
+        obj.dist = dist
+        obj.pred = pred
+        return obj
+
+    @classmethod
+    def from_graph(cls, graph, weight="latency"):
+        obj = cls(capacity=max(len(graph), 1))
+        for node in graph:
+            obj.get_index(node)
+        for node_src, node_dst, attr in graph.edges(data=True):
+            obj.set_edge(node_src, node_dst, attr[weight], attr.get("rtt", np.nan),
+                         attr.get("port", -1))
+        return obj
 
 
 class NetworkModel:
@@ -24,22 +134,151 @@ class NetworkModel:
     NODE_TYPE_WORKER = 2
     NODE_TYPE_MASTER = 3
 
-    def __init__(self):
+    def __init__(self, estimator="ewma", threshold_rel=0.05, threshold_abs=0.01,
+                 history=DEFAULT_TIERS, **kwargs):
         self.model = nx.DiGraph()
+        self.epoch = 0
+        self.path_cache = {}
+        self.matrix = LatencyMatrix()
+        self.load = {}
+        self.estimators = {}
+        self.set_estimator(estimator, **kwargs)
+        self.threshold_rel = threshold_rel
+        self.threshold_abs = threshold_abs
+        self.subscribers = []
+        self.history = HistoryStore(history)
+        self.cache = {}
+        self.cache_epoch = 0
+
+    def set_estimator(self, name, **kwargs):
+        self.estimator_factory = get_estimator_factory(name, **kwargs)
+        self.estimator = {"name": name, **kwargs}
+        self.estimators.clear()
+
+    def get_estimator(self, node_id_src, node_id_dst):
+        try:
+            return self.estimators[(node_id_src, node_id_dst)]
+        except KeyError:
+            estimator = self.estimator_factory()
+            self.estimators[(node_id_src, node_id_dst)] = estimator
+            return estimator
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self.subscribers.remove(callback)
+
+    def is_significant(self, published, latency):
+        delta = abs(latency - published)
+        return delta > self.threshold_abs and delta > self.threshold_rel * abs(published)
+
+    def update_node(self, node_id, attr):
+        if "probes" in attr:
+            self.history.record_node(node_id, attr["probes"])
+        if node_id not in self.model:
+            self.model.add_node(node_id, **attr)
+            return True
+        data = self.model.nodes[node_id]
+        structural = data.get("node_type") != attr.get("node_type")
+        data.update(attr)
+        return structural
 
     def update(self, attr):
-        # print(json.dumps(attr, indent=4))
-        node_id_src = attr["src"].pop("node_id")
-        node_id_dst = attr["dst"].pop("node_id")
-        rtt = attr["link"]["rtt"]
-        rtt_queue = attr["link"]["rtt_queue"]
-        latency = rtt_queue - rtt / 2
-        # print("%x -> %x : %f ms (%f ms)" % (node_id_src, node_id_dst, latency, rtt / 2))
-        # with open("%x-%x.csv" % (node_id_src, node_id_dst), "a+") as fp:
-        #     fp.write("%f;%f;%f;%f\n" % (rtt, rtt_queue, rtt / 2, latency))
-        self.model.add_node(node_id_src, **attr["src"])
-        self.model.add_node(node_id_dst, **attr["dst"])
-        self.model.add_edge(node_id_src, node_id_dst, latency=latency, **attr["link"])
+        self.update_batch([attr])
+
+    def update_batch(self, attrs):
+        changes = {}
+        structural = False
+        for attr in attrs:
+            # print(json.dumps(attr, indent=4))
+            node_id_src = attr["src"].pop("node_id")
+            node_id_dst = attr["dst"].pop("node_id")
+            rtt = attr["link"]["rtt"]
+            rtt_queue = attr["link"]["rtt_queue"]
+            latency_raw = rtt_queue - rtt / 2
+            latency = self.get_estimator(node_id_src, node_id_dst).update(latency_raw, rtt)
+            # print("%x -> %x : %f ms (%f ms)" % (node_id_src, node_id_dst, latency, rtt / 2))
+            # with open("%x-%x.csv" % (node_id_src, node_id_dst), "a+") as fp:
+            #     fp.write("%f;%f;%f;%f\n" % (rtt, rtt_queue, rtt / 2, latency))
+            changed = self.update_node(node_id_src, attr["src"])
+            changed |= self.update_node(node_id_dst, attr["dst"])
+            if self.model.has_edge(node_id_src, node_id_dst):
+                data = self.model[node_id_src][node_id_dst]
+                changed |= data.get("port") != attr["link"].get("port")
+                changed |= data.get("addr") != attr["link"].get("addr")
+                published = data["latency"]
+                if changed or self.is_significant(published, latency):
+                    published = latency
+                    changes[(node_id_src, node_id_dst)] = latency
+                # only the published latency is seen by placements and caches,
+                # the smoothed value keeps tracking sub-threshold drifts
+                data.update(attr["link"], latency=published,
+                            latency_smoothed=latency, latency_raw=latency_raw)
+            else:
+                changed = True
+                published = latency
+                changes[(node_id_src, node_id_dst)] = latency
+                self.model.add_edge(node_id_src, node_id_dst, latency=latency,
+                                    latency_smoothed=latency, latency_raw=latency_raw,
+                                    **attr["link"])
+            structural |= changed
+            self.history.record_edge(node_id_src, node_id_dst, self.model[node_id_src][node_id_dst])
+            self.matrix.set_edge(node_id_src, node_id_dst, published, rtt, attr["link"]["port"])
+        if changes:
+            self.epoch += 1
+            self.repair_shortest_paths(changes)
+            for callback in self.subscribers:
+                callback(self, changes, structural)
+
+    def get_cached(self, key, factory):
+        if self.cache_epoch != self.epoch:
+            self.cache.clear()
+            self.cache_epoch = self.epoch
+        try:
+            return self.cache[key]
+        except KeyError:
+            self.cache[key] = factory()
+            return self.cache[key]
+
+    def get_shortest_paths(self, source):
+        try:
+            return self.path_cache[source]
+        except KeyError:
+            self.path_cache[source] = nx.single_source_dijkstra(
+                G=self.model,
+                source=source,
+                weight="latency"
+            )
+            return self.path_cache[source]
+
+    def repair_shortest_paths(self, changes):
+        # a shortest path tree stays valid unless one of the changed edges is
+        # part of it or its new latency makes it a shortcut to node_dst
+        for source in list(self.path_cache):
+            costs, paths = self.path_cache[source]
+            for (node_src, node_dst), latency in changes.items():
+                if node_src not in costs:
+                    continue
+                if node_dst in paths and paths[node_dst][-2:] == [node_src, node_dst]:
+                    del self.path_cache[source]
+                    break
+                if costs[node_src] + latency < costs.get(node_dst, float("inf")):
+                    del self.path_cache[source]
+                    break
+
+    def reserve(self, nodes):
+        for node_id in nodes:
+            self.load[node_id] = self.load.get(node_id, 0) + 1
+
+    def free(self, nodes):
+        for node_id in nodes:
+            try:
+                self.load[node_id] -= 1
+                if self.load[node_id] <= 0:
+                    del self.load[node_id]
+            except KeyError:
+                pass
 
     def get_port(self, node_src, node_dst):
         return self.model[node_dst][node_src]["port"]
@@ -49,6 +288,10 @@ class NetworkModel:
 
     def as_dict(self):
         return {
+            "epoch": self.epoch,
+            "estimator": self.estimator,
+            "threshold": {"rel": self.threshold_rel, "abs": self.threshold_abs},
+            "load": self.load,
             "nodes": dict(self.model.nodes(data=True)),
             "edges": [{"src": a, "dst": b, "attr": dict(c)}
                       for a, b, c in self.model.edges(data=True)],
@@ -0,0 +1,185 @@
+# Copyright (C) 2019 Patrick Ziegler
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import ctypes
+import ipaddress
+import os
+import socket
+import struct
+from contextlib import contextmanager
+
+CLONE_NEWNET = 0x40000000
+
+NETLINK_ROUTE = 0
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x1
+NLM_F_ACK = 0x4
+NLM_F_EXCL = 0x200
+NLM_F_CREATE = 0x400
+
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_GETLINK = 18
+RTM_NEWADDR = 20
+
+IFLA_IFNAME = 3
+IFLA_LINKINFO = 18
+IFLA_NET_NS_FD = 28
+IFLA_INFO_KIND = 1
+IFLA_INFO_DATA = 2
+VETH_INFO_PEER = 1
+
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+
+IFF_UP = 0x1
+
+NLMSGHDR = struct.Struct("=IHHII")
+IFINFOMSG = struct.Struct("=BxHiII")
+IFADDRMSG = struct.Struct("=BBBBI")
+RTATTR = struct.Struct("=HH")
+
+LIBC = ctypes.CDLL(None, use_errno=True)
+
+
+def get_netns_path(netns):
+    if isinstance(netns, int):
+        return "/proc/%s/ns/net" % netns
+    return "/var/run/netns/%s" % netns
+
+
+def setns(fd):
+    if LIBC.setns(fd, CLONE_NEWNET) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+
+
+@contextmanager
+def enter_netns(netns):
+    if netns is None:
+        yield
+        return
+    fd_self = os.open("/proc/thread-self/ns/net", os.O_RDONLY)
+    fd_netns = os.open(get_netns_path(netns), os.O_RDONLY)
+    try:
+        setns(fd_netns)
+        try:
+            yield
+        finally:
+            setns(fd_self)
+    finally:
+        os.close(fd_netns)
+        os.close(fd_self)
+
+
+def rtattr(attr_type, data):
+    if isinstance(data, str):
+        data = data.encode() + b"\0"
+    attr = RTATTR.pack(RTATTR.size + len(data), attr_type) + data
+    return attr + b"\0" * (-len(attr) % 4)
+
+
+class NetlinkRoute:
+
+    def __init__(self, netns=None):
+        self.netns = netns
+        with enter_netns(netns):
+            # the socket stays bound to the namespace it was created in
+            self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+        self.sock.bind((0, 0))
+        self.seq = 0
+
+    def close(self):
+        self.sock.close()
+
+    def request(self, msg_type, payload, flags=0):
+        self.seq += 1
+        flags |= NLM_F_REQUEST | NLM_F_ACK
+        self.sock.send(NLMSGHDR.pack(NLMSGHDR.size + len(payload), msg_type, flags, self.seq, 0)
+                       + payload)
+        replies = []
+        while True:
+            data = self.sock.recv(65536)
+            offset = 0
+            while offset < len(data):
+                length, reply_type, _, seq, _ = NLMSGHDR.unpack_from(data, offset)
+                body = data[offset + NLMSGHDR.size:offset + length]
+                offset += (length + 3) & ~3
+                if seq != self.seq:
+                    continue
+                if reply_type == NLMSG_ERROR:
+                    err = -struct.unpack_from("=i", body)[0]
+                    if err:
+                        raise OSError(err, os.strerror(err))
+                    return replies
+                if reply_type == NLMSG_DONE:
+                    return replies
+                replies.append((reply_type, body))
+
+    def link_add_veth(self, name, peer, peer_netns=None):
+        peer_attrs = rtattr(IFLA_IFNAME, peer)
+        fd = None
+        if peer_netns is not None:
+            fd = os.open(get_netns_path(peer_netns), os.O_RDONLY)
+            peer_attrs += rtattr(IFLA_NET_NS_FD, struct.pack("=I", fd))
+        try:
+            self.request(
+                RTM_NEWLINK,
+                IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0)
+                + rtattr(IFLA_IFNAME, name)
+                + rtattr(IFLA_LINKINFO, rtattr(IFLA_INFO_KIND, "veth") + rtattr(
+                    IFLA_INFO_DATA, rtattr(
+                        VETH_INFO_PEER, IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0) + peer_attrs
+                    )
+                )),
+                flags=NLM_F_CREATE | NLM_F_EXCL,
+            )
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+    def link_set_up(self, name):
+        self.request(
+            RTM_NEWLINK,
+            IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, IFF_UP, IFF_UP) + rtattr(IFLA_IFNAME, name),
+        )
+
+    def link_del(self, name):
+        self.request(
+            RTM_DELLINK,
+            IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0) + rtattr(IFLA_IFNAME, name),
+        )
+
+    def link_get_index(self, name):
+        replies = self.request(
+            RTM_GETLINK,
+            IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0) + rtattr(IFLA_IFNAME, name),
+        )
+        for reply_type, body in replies:
+            if reply_type == RTM_NEWLINK:
+                return IFINFOMSG.unpack_from(body)[2]
+        raise KeyError("Could not find interface '%s'" % name)
+
+    def addr_add(self, name, addr):
+        iface = ipaddress.ip_interface(addr)
+        family = socket.AF_INET if iface.version == 4 else socket.AF_INET6
+        self.request(
+            RTM_NEWADDR,
+            IFADDRMSG.pack(family, iface.network.prefixlen, 0, 0, self.link_get_index(name))
+            + rtattr(IFA_LOCAL, iface.ip.packed)
+            + rtattr(IFA_ADDRESS, iface.ip.packed),
+            flags=NLM_F_CREATE | NLM_F_EXCL,
+        )
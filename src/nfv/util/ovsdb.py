@@ -0,0 +1,151 @@
+# Copyright (C) 2019 Patrick Ziegler
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import socket
+
+
+class OVSDBClient:
+
+    DATABASE = "Open_vSwitch"
+
+    def __init__(self, path, timeout=5):
+        self.path = path
+        self.timeout = timeout
+        self.sock = None
+        self.buffer = b""
+        self.decoder = json.JSONDecoder()
+        self.msg_id = 0
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+        self.buffer = b""
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def send(self, msg):
+        self.sock.sendall(json.dumps(msg).encode())
+
+    def recv(self):
+        while True:
+            data = self.buffer.lstrip()
+            if data:
+                try:
+                    msg, end = self.decoder.raw_decode(data.decode())
+                    self.buffer = data[end:]
+                    return msg
+                except ValueError:
+                    pass  # message not yet complete
+            chunk = self.sock.recv(4096)
+            if not chunk:
+                raise ConnectionError("OVSDB connection to '%s' closed" % self.path)
+            self.buffer = data + chunk
+
+    def call(self, method, *params):
+        if self.sock is None:
+            self.connect()
+        self.msg_id += 1
+        msg_id = self.msg_id
+        try:
+            self.send({"method": method, "params": params, "id": msg_id})
+            while True:
+                msg = self.recv()
+                if msg.get("method") == "echo":
+                    self.send({"result": msg["params"], "error": None, "id": msg["id"]})
+                elif msg.get("id") == msg_id:
+                    break
+        except OSError:
+            self.close()
+            raise
+        if msg["error"] is not None:
+            raise SystemError(msg["error"])
+        return msg["result"]
+
+    def transact(self, *ops):
+        result = self.call("transact", self.DATABASE, *ops)
+        for res in result:
+            if res is not None and "error" in res:
+                raise SystemError("%s: %s" % (res["error"], res.get("details", "")))
+        return result
+
+    def add_port(self, bridge, iface):
+        result = self.transact(
+            {
+                "op": "insert",
+                "table": "Interface",
+                "row": {"name": iface},
+                "uuid-name": "iface",
+            },
+            {
+                "op": "insert",
+                "table": "Port",
+                "row": {"name": iface, "interfaces": ["named-uuid", "iface"]},
+                "uuid-name": "port",
+            },
+            {
+                "op": "mutate",
+                "table": "Bridge",
+                "where": [["name", "==", bridge]],
+                "mutations": [["ports", "insert", ["set", [["named-uuid", "port"]]]]],
+            },
+        )
+        if result[2]["count"] != 1:
+            raise SystemError("Could not find bridge '%s'" % bridge)
+
+    def get_port(self, iface, timeout=5000):
+        result = self.transact(
+            {
+                "op": "wait",
+                "table": "Interface",
+                "where": [["name", "==", iface]],
+                "columns": ["ofport"],
+                "until": "!=",
+                "rows": [{"ofport": ["set", []]}],
+                "timeout": timeout,
+            },
+            {
+                "op": "select",
+                "table": "Interface",
+                "where": [["name", "==", iface]],
+                "columns": ["ofport"],
+            },
+        )
+        try:
+            return int(result[1]["rows"][0]["ofport"])
+        except (IndexError, TypeError):
+            raise KeyError("Could not find interface '%s'" % iface)
+
+    def del_port(self, bridge, iface):
+        result = self.transact({
+            "op": "select",
+            "table": "Port",
+            "where": [["name", "==", iface]],
+            "columns": ["_uuid"],
+        })
+        ports = [row["_uuid"] for row in result[0]["rows"]]
+        if not ports:
+            return
+        # port and interface rows are garbage collected once unreferenced
+        self.transact({
+            "op": "mutate",
+            "table": "Bridge",
+            "where": [["name", "==", bridge]],
+            "mutations": [["ports", "delete", ["set", ports]]],
+        })
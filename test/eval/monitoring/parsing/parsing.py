@@ -0,0 +1,53 @@
+import struct
+import timeit
+import uuid
+
+import ryu.lib.packet as packet
+
+from nfv.monitoring.lldp import LLDPMonitor
+
+
+def build_sample(node_id, rtt=1200000, rtt_queue=1500000):
+    fields = LLDPMonitor.interpret_node_id(node_id)
+    pkt = LLDPMonitor.build_probing_packet(fields["chassis_id"], fields["port_id"])
+    data = bytearray(pkt.data)
+    # the switch fills in the measured values in host byte order
+    offset = data.index(LLDPMonitor.PROJECT_OID + b'\x01') + 4
+    data[offset:offset + 8] = struct.pack("=Q", rtt)
+    offset = data.index(LLDPMonitor.PROJECT_OID + b'\x02') + 4
+    data[offset:offset + 8] = struct.pack("=Q", rtt_queue)
+    data[6:12] = b'\x02\x00\x00\x00\x00\x01'
+    return bytes(data)
+
+
+def parse_full(monitor, datapath, match, data):
+    pkt = packet.packet.Packet(data)
+    prot_eth = pkt.get_protocol(packet.ethernet.ethernet)
+    prot_lldp = pkt.get_protocol(packet.lldp.lldp)
+    return monitor.parse(datapath, match, prot_eth, prot_lldp)
+
+
+def main(number=20000):
+    monitor = LLDPMonitor()
+    datapath = object()
+    monitor.pool[datapath] = {"node_id": 1, "node_type": 1}
+    match = {"in_port": 3}
+
+    for node_id in (0x2a, uuid.uuid4()):
+        data = build_sample(node_id)
+        attr_full = parse_full(monitor, datapath, match, data)
+        attr_raw = monitor.parse_raw(datapath, match, data)
+        assert attr_full == attr_raw, (attr_full, attr_raw)
+
+        t_full = timeit.timeit(lambda: parse_full(monitor, datapath, match, data), number=number)
+        t_raw = timeit.timeit(lambda: monitor.parse_raw(datapath, match, data), number=number)
+        print("%-32s full: %6.2f us  raw: %6.2f us  speed-up: %5.1fx" % (
+            attr_raw["src"]["node_id"],
+            1e6 * t_full / number,
+            1e6 * t_raw / number,
+            t_full / t_raw,
+        ))
+
+
+if __name__ == "__main__":
+    main()
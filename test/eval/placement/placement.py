@@ -52,7 +52,7 @@ def plot_graph(g):
 
 
 if __name__ == "__main__":
-    from nfv.placement.algo import HastyTraveller, RandomPlacement
+    from nfv.placement.algo import ExactPlacement, HastyTraveller, RandomPlacement
     import itertools
     import time
 
@@ -73,6 +73,9 @@ if __name__ == "__main__":
     lat_rand = np.zeros(shape=(n, 2))
     time_random = np.zeros(shape=(n, 1))
 
+    lat_exact = np.zeros(shape=(n, 1))
+    time_exact = np.zeros(shape=(n, 1))
+
     for i in range(n):
         for j in range(m):
             print("%d - %d" % (i, j))
@@ -88,6 +91,12 @@ if __name__ == "__main__":
             time_mesh[i, j] = t1 - t0
             time_search[i, j] = t2 - t1
         t0 = time.time()
+        algo = ExactPlacement(src, dst, chain_length=i+1)
+        algo.prepare(model)
+        _, attrs = algo.calc()
+        lat_exact[i, 0] = attrs["latency"]
+        time_exact[i, 0] = time.time() - t0
+        t0 = time.time()
         for k in range(r):
             algo = RandomPlacement(src, dst, chain_length=i+1)
             algo.prepare(model)
@@ -105,6 +114,7 @@ if __name__ == "__main__":
     max_lat = np.max(lat_rand)
     lat_rand /= max_lat
     lat_optim /= max_lat
+    lat_exact /= max_lat
     print(max_lat)
 
     print(lat_optim)
@@ -142,6 +152,7 @@ if __name__ == "__main__":
     # plt.plot(np.arange(m) + 1, lat_optim[np.where(np.eye(n, m))], marker=next(marker), label="Optim")
     for i in range(m):
         plt.plot(x, lat_optim[:, i], marker=next(marker), label="HT-%d" % (i + 1))
+    plt.plot(x, lat_exact, marker=next(marker), label="Exact")
     plt.xlabel("Chain length")
     plt.ylabel("Latency (normalized)")
     plt.legend()
@@ -160,6 +171,7 @@ if __name__ == "__main__":
     for i in range(m):
         plt.plot(x, time_search[:, i], marker=next(marker), label="HT-%d" % (i + 1))
     plt.plot(np.arange(m) + 1, time_random, marker=next(marker), label="RP-%d" % r)
+    plt.plot(x, time_exact, marker=next(marker), label="Exact")
     plt.xlabel("Chain length")
     plt.ylabel("Execution Time / s")
     plt.legend()